@@ -4,22 +4,29 @@ import os
 import sys
 from copy import copy
 from datetime import datetime, timedelta
-from math import radians
-from multiprocessing import Pool
 
+import numpy as np
 import pytz
 from pandas import Timestamp
-from pvlib.solarposition import calc_time
 
-from pv_timelapse.config import create_dict, configure
+from pv_timelapse.config import create_dict, create_options, configure, \
+    create_outputs
 from pv_timelapse.create_timelapse import create_timelapse
 from pv_timelapse.indexing import Params
+from pv_timelapse.instrumentation import combine_reports, write_report
+from pv_timelapse.live import LiveTimelapse
+from pv_timelapse.outputs import OutputSpec
+from pv_timelapse.scheduler import run_jobs
+from pv_timelapse.solar_window import SolarWindow
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-cfg', '--config_file', type=str, dest='cfg',
                         help='Name or location of the config file to use',
                         default='config.ini')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Follow the folder of the current day and keep '
+                             'a live timelapse of it up to date')
     in_args = parser.parse_args()
 
     cfg = configure(in_args.cfg)
@@ -47,7 +54,7 @@ if __name__ == '__main__':
         latitude = cfg.getfloat('Solar', 'latitude')
         longitude = cfg.getfloat('Solar', 'longitude')
         altitude = cfg.getfloat('Solar', 'altitude')
-        min = radians(cfg.getfloat('Solar', 'minimum elevation'))
+        min_elevation = cfg.getfloat('Solar', 'minimum elevation')
         tz = pytz.timezone(cfg['Solar']['time zone'])
     except Exception as e:
         print(e)
@@ -63,6 +70,10 @@ if __name__ == '__main__':
         endval = cfg.getint('Timing', 'end day')
         first_day = datetime.now(tz=tz)
 
+    if in_args.watch:
+        first_day = datetime.now(tz=tz)
+        startval = endval = 0
+
     threads = cfg.getint('Codec Options', 'threads', fallback=1)
 
     if endval > cfg.getint('Timing', 'max days'):
@@ -79,38 +90,31 @@ if __name__ == '__main__':
                         cfg['Database']['database'],
                         cfg['Database']['table name'],
                         cfg['Database']['table column'],
-                        cfg['Database']['time column'], defer_img_indexing=True)
+                        cfg['Database']['time column'], defer_img_indexing=True,
+                        **create_options(cfg))
 
-    param_container = []
+    # Sunrise and sunset of every day in one pass, cached per site
+    solar = SolarWindow(latitude, longitude, altitude, tz, min_elevation,
+                        cache_dir=create_options(cfg)['cache_dir'])
+    sunrises, sunsets = solar.windows(
+        Timestamp(first_day.year, first_day.month, first_day.day) +
+        timedelta(days=startval), endval - startval + 1)
+
+    days = []
 
     for x in range(startval, endval + 1):
         start_day = Timestamp(first_day.year, first_day.month,
                               first_day.day).tz_localize(tz=tz) + timedelta(
             days=x)
 
-        folder_name = start_day.strftime(
-            cfg['Formatting']['folder name format'])
-        day_path = os.path.join(source_path, folder_name)
-        if not os.path.isdir(day_path):
-            logging.warning(f'Missing folder: {folder_name}')
+        # Days without a folder are skipped by the worker indexing them, so
+        # the share is not walked here one day after the other
+        if np.isnat(sunrises[x - startval]):
+            logging.warning(f'The sun stays below the minimum elevation on '
+                            f'{start_day:%Y-%m-%d}')
             continue
-
-        interval_noon = (start_day + timedelta(hours=12)).tz_convert('UTC')
-        interval_end = (start_day + timedelta(hours=23, minutes=59)).tz_convert(
-            'UTC')
-
-        sunrise_utc = Timestamp(calc_time(start_day, interval_noon, latitude,
-                                          longitude, 'alt', min,
-                                          altitude=altitude),
-                                tz='UTC')
-        start_datetime = sunrise_utc.tz_convert(tz).tz_localize(
-            None).to_pydatetime()
-        sunset_utc = Timestamp(calc_time(interval_noon, interval_end, latitude,
-                                         longitude, 'alt', min,
-                                         altitude=altitude),
-                               tz='UTC')
-        end_datetime = sunset_utc.tz_convert(tz).tz_localize(
-            None).to_pydatetime()
+        start_datetime = Timestamp(sunrises[x - startval]).to_pydatetime()
+        end_datetime = Timestamp(sunsets[x - startval]).to_pydatetime()
 
         try:
             name = datetime.strftime(start_datetime, basename)
@@ -125,16 +129,98 @@ if __name__ == '__main__':
         if os.path.isfile(write_path) and cfg.getboolean('Files', 'overwrite'):
             logging.info('File already exists. Overwriting.')
         elif os.path.isfile(write_path) and not \
-                cfg.getboolean('Files', 'overwrite'):
+                cfg.getboolean('Files', 'overwrite') and not in_args.watch:
             logging.warning('Overwrite set to false and file already exists. '
                             'Skipping file.')
             continue
-        logging.info(f'Pulling data and folder information for '
-                     f'{start_datetime.strftime("%Y-%m-%d")}')
+        days += [(start_datetime, end_datetime, write_path, seg_name)]
+
+    if in_args.watch:
+        if not days:
+            sys.exit('No solar window to follow today')
+        start_datetime, end_datetime, write_path, seg_name = days[0]
+        p = copy(base_param)
+        # The live timelapse queries the irradiance as it is logged
+        p.set_dates(start_datetime, end_datetime, write_path,
+                    ghi=(np.array([], dtype='datetime64[ns]'),
+                         np.array([], dtype=np.float32)))
+        live = LiveTimelapse(p, cfg.getint('Live', 'frame step', fallback=1),
+                             cfg.getint('Live', 'playlist window',
+                                        fallback=0), tz=tz)
+        print(f'Following {start_datetime:%Y-%m-%d} until {end_datetime}')
+        live.run(cfg.getfloat('Live', 'update interval', fallback=300))
+        sys.exit()
+
+    # One query for the irradiance of every day instead of one per day
+    logging.info(f'Pulling irradiance data for {len(days)} days')
+    ghi = base_param.irradiance.fetch_many([day[:2] for day in days])
+    base_param.irradiance.close()
+
+    def output_spec(output: dict, start_datetime: datetime) -> OutputSpec:
+        """The output of a config section for a video starting at a date"""
+        output = dict(output)
+        output.pop('span')
+        output_name = output.pop('name')
+        try:
+            output_name = datetime.strftime(start_datetime, output_name)
+        except:
+            pass
+        output_name = os.path.splitext(output_name)[0] + ext
+        return OutputSpec(os.path.join(output_path, output_name), **output)
+
+    outputs = create_outputs(cfg)
+    param_container = []
+    for (start_datetime, end_datetime, write_path, seg_name), day_ghi \
+            in zip(days, ghi):
         p_add = copy(base_param)
-        p_add.set_dates(start_datetime, end_datetime, write_path, seg_name)
+        p_add.set_dates(start_datetime, end_datetime, write_path, seg_name,
+                        ghi=day_ghi)
+        # The copy would share the list of the base container
+        p_add.outputs = [output_spec(output, start_datetime)
+                         for output in outputs if output['span'] == 'day']
         param_container += [p_add]
 
-    with Pool(processes=threads) as pool:
+    run_outputs = [output for output in outputs if output['span'] == 'run']
+    if days and run_outputs:
+        # The images of every day's window, without the nights in between
+        p_run = copy(base_param)
+        p_run.set_dates(days[0][0], days[-1][1], '', ghi=(
+            np.concatenate([day_ghi[0] for day_ghi in ghi]),
+            np.concatenate([day_ghi[1] for day_ghi in ghi])))
+        p_run.outputs = []
+        p_run.image_indexing()
+        window_starts = np.array([day[0] for day in days],
+                                 dtype='datetime64[ns]')
+        window_ends = np.array([day[1] for day in days],
+                               dtype='datetime64[ns]')
+        times = p_run.image_times.to_numpy()
+        window = np.searchsorted(window_starts, times, 'right') - 1
+        p_run.image_times = p_run.image_times[
+            (window >= 0) & (times <= window_ends[np.maximum(window, 0)])]
+        for output in run_outputs:
+            param_container += [
+                output_spec(output, days[0][0]).params(p_run)]
+
+    reports = []
+    if cfg.getboolean('Codec Options', 'intra-day parallel', fallback=False) \
+            and len(param_container) < threads:
+        # Pool workers cannot start processes of their own, so the days run
+        # here one by one and each spreads its frames over every thread
+        print(f'Rendering frames with {threads} processes per day')
+        for p in param_container:
+            p.frame_workers = threads
+            reports += [create_timelapse(p)]
+    else:
         print(f'Simultaneous multithreading with {threads} threads')
-        pool.map(create_timelapse, param_container)
+        for result in run_jobs(param_container, threads):
+            status = 'done' if result.ok else 'failed'
+            print(f'{os.path.basename(result.write)} {status} in '
+                  f'{result.seconds:.1f} s')
+            if result.report is not None:
+                reports += [result.report]
+
+    if base_param.report and reports:
+        # Totals over the days, whichever worker rendered them
+        write_report(combine_reports(reports), os.path.join(
+            output_path, datetime.now().strftime('run-%Y%m%d-%H%M%S') +
+            '.stats.json'))
@@ -0,0 +1,405 @@
+"""
+Benchmarks on a synthetic sky camera archive and a local stand-in for the
+irradiance database, so performance can be measured without the share and
+the MySQL server.
+
+    python -m pv_timelapse.benchmark -o results.json -b baseline.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import timeit
+from copy import copy
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from pv_timelapse.indexing import Params
+from pv_timelapse.irradiance import IrradianceSource
+from pv_timelapse.resampling import resize_frame, scaled_shape
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FOLDER_FORMAT = '%Y-%m-%d'
+IMAGE_NAME_FORMAT = '%Y-%m-%d--%H-%M-%S.jpg'
+TABLE = 'irradiance'
+COLUMN = 'ghi'
+TIME_COLUMN = 'time_stamp'
+# Size of the irradiance plot of both renderers
+PLOT_SHAPE = (480, 640)
+
+
+def sky_image(shape: tuple, clouds: np.ndarray,
+              cover: float = 0.5) -> np.ndarray:
+    """
+    A fisheye sky: a blue disk brightening towards the horizon with white
+    clouds, black outside the lens circle
+
+    :param shape: (height, width) of the image
+    :param clouds: small 2D float array of smooth noise in [0, 1]
+    :param cover: share of the sky covered by clouds
+    :return: uint8 RGB image
+    """
+    height, width = shape
+    y = (np.arange(height)[::, np.newaxis] - height / 2) / (height / 2)
+    x = (np.arange(width)[np.newaxis, ::] - width / 2) / (width / 2)
+    r = np.sqrt(x ** 2 + y ** 2)
+    noise = resize_frame((clouds * 255).astype(np.uint8), shape) / 255
+    cloud = np.clip((noise - (1 - cover)) * 4, 0, 1)[::, ::, np.newaxis]
+    sky = np.stack([60 + 60 * r, 110 + 60 * r, 225 + 20 * r], axis=2)
+    image = sky * (1 - cloud) + np.array([225, 228, 235]) * cloud
+    image[r > 1] = 0
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def make_archive(root: os.path.abspath, start: datetime, days: int = 1,
+                 hours: float = 10, cadence: float = 30,
+                 shape: tuple = (1600, 1600), seed: int = 0) -> int:
+    """
+    Writes a synthetic archive with the folder and file names of the sky
+    camera. Clouds drift across the sky so consecutive images differ.
+
+    :param root: directory receiving the day folders
+    :param start: date and time of the first image of every day
+    :param days: number of days
+    :param hours: hours of images per day
+    :param cadence: seconds between images
+    :param shape: (height, width) of the images
+    :param seed: seed for the cloud pattern
+    :return: number of images written
+    """
+    rng = np.random.default_rng(seed)
+    per_day = int(hours * 3600 // cadence) + 1
+    written = 0
+    for day in range(days):
+        first = start + timedelta(days=day)
+        folder = os.path.join(root, first.strftime(FOLDER_FORMAT))
+        os.makedirs(folder, exist_ok=True)
+        # A wide noise field the camera's view slides along
+        field = rng.random((8, 8 + per_day // 20 + 1))
+        cover = rng.uniform(0.2, 0.8)
+        for n in range(per_day):
+            img_date = first + timedelta(seconds=n * cadence)
+            image = sky_image(shape, field[::, n // 20:n // 20 + 8], cover)
+            path = os.path.join(folder, img_date.strftime(IMAGE_NAME_FORMAT))
+            if Image is not None:
+                Image.fromarray(image).save(path, quality=90)
+            else:
+                from skimage.io import imsave
+                imsave(path, image, quality=90)
+            written += 1
+    return written
+
+
+def make_irradiance_db(path: os.path.abspath, start: datetime,
+                       end: datetime, cadence: float = 1,
+                       seed: int = 0) -> int:
+    """
+    Writes a SQLite stand-in for the irradiance table, with a clear sky
+    curve dimmed by passing clouds
+
+    :param path: database file, replaced if it exists
+    :param start: first timestamp
+    :param end: last timestamp
+    :param cadence: seconds between rows
+    :param seed: seed for the cloud dips
+    :return: number of rows written
+    """
+    rng = np.random.default_rng(seed)
+    seconds = np.arange(0, (end - start).total_seconds() + cadence, cadence)
+    midnight = datetime(start.year, start.month, start.day)
+    day_seconds = ((start - midnight).total_seconds() + seconds) % 86400
+    daylight = np.clip(np.sin(np.pi * day_seconds / 86400 * 1.6 - 0.3),
+                       0, None)
+    dips = np.repeat(rng.random(len(seconds) // 60 + 1), 60)[:len(seconds)]
+    values = 1000 * daylight * (1 - 0.6 * (dips > 0.6))
+    if os.path.isfile(path):
+        os.remove(path)
+    with sqlite3.connect(path) as db:
+        db.execute(f'CREATE TABLE {TABLE} ({TIME_COLUMN} TEXT, {COLUMN} REAL)')
+        db.execute(f'CREATE INDEX time_index ON {TABLE} ({TIME_COLUMN})')
+        db.executemany(
+            f'INSERT INTO {TABLE} VALUES (?, ?)',
+            ((str(start + timedelta(seconds=float(s))), float(v))
+             for s, v in zip(seconds, values)))
+    db.close()
+    return len(seconds)
+
+
+def bench_params(root: os.path.abspath, db: os.path.abspath,
+                 start: datetime, end: datetime, duration: float = 10,
+                 frame_rate: int = 30, resolution: int = 50,
+                 write: os.path.abspath = None, **kwargs) -> Params:
+    """
+    Parameter container for the synthetic archive, reading the irradiance
+    from the stand-in database
+
+    :param root: archive written by make_archive
+    :param db: database written by make_irradiance_db
+    :param start: start of the timelapse
+    :param end: end of the timelapse
+    :param duration: length of the video in seconds
+    :param frame_rate: frames per second of the video
+    :param resolution: output resolution as percentage of input
+    :param write: output video
+    :param kwargs: further Params options
+    :return: the container with dates set and images indexed
+    """
+    p = Params(root, duration, resolution, FOLDER_FORMAT, IMAGE_NAME_FORMAT,
+               False, {'-r': str(frame_rate)},
+               {'-codec:v': 'libx264', '-preset': 'veryfast', '-crf': '23'},
+               '', '', 'localhost', 0, '', TABLE, COLUMN, TIME_COLUMN,
+               **kwargs)
+    p.irradiance = IrradianceSource.sqlite(db, TABLE, COLUMN, TIME_COLUMN)
+    p.show_pbar = False
+    p.set_dates(start, end, write)
+    return p
+
+
+def plot_fits(shape: tuple, resolution: int) -> bool:
+    """
+    Whether the plot fits into the frames of images of a shape
+
+    :param shape: (height, width) of the images
+    :param resolution: output resolution as percentage of input
+    """
+    from pv_timelapse.frame_tools import Compositor
+    try:
+        Compositor(scaled_shape(tuple(shape) + (3,), resolution),
+                   PLOT_SHAPE + (3,))
+    except ValueError:
+        return False
+    return True
+
+
+def time_call(func: Callable[[], object], number: int = 10,
+              repeat: int = 3) -> float:
+    """
+    Seconds per call, the best of several repeats as with timeit
+
+    :param func: function to time
+    :param number: calls per repeat
+    :param repeat: number of repeats
+    :return: seconds per call
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def micro_benchmarks(p: Params, number: int = 10) -> Dict[str, float]:
+    """
+    Times the stages of rendering one frame on their own
+
+    :param p: container from bench_params
+    :param number: calls per repeat
+    :return: seconds per call of every stage
+    """
+    from pv_timelapse.frame_tools import overlay, process_frame
+    from pv_timelapse.loading import load_frame
+    from pv_timelapse.plotting import PlotRenderer
+    from pv_timelapse.raster_plot import RasterPlotRenderer
+    from pv_timelapse.segmentation import cloud_fraction, sky_mask
+    from pv_timelapse.frame_plan import FramePlan
+
+    dates = p.image_times
+    middle = dates[len(dates) // 2]
+    path = p.date_to_path(middle)
+    frame = load_frame(path, p.resolution, p.loader, p.resampling)
+    cycle = itertools.cycle(dates)
+    results = {
+        'load_frame': time_call(
+            lambda: load_frame(path, p.resolution, p.loader, p.resampling),
+            number),
+        'FramePlan.from_params': time_call(
+            lambda: FramePlan.from_params(p), number)}
+    for name, renderer_class in [('matplotlib', PlotRenderer),
+                                 ('numpy', RasterPlotRenderer)]:
+        renderer = renderer_class(p)
+        results[f'plot init {name}'] = time_call(
+            lambda: renderer_class(p), 1, 3)
+        results[f'plot_ghi {name}'] = time_call(
+            lambda: renderer.render(next(cycle)), number)
+    renderer = RasterPlotRenderer(p)
+    plot = renderer.render(middle)
+    results['process_frame'] = time_call(
+        lambda: process_frame(frame, 100, plot, p.resampling,
+                              mask=renderer.mask), number)
+    results['overlay'] = time_call(
+        lambda: overlay(frame.copy(), plot), number)
+    batch = np.stack([frame] * 8)
+    mask = sky_mask(frame.shape)
+    results['cloud_fraction per image'] = time_call(
+        lambda: cloud_fraction(batch, mask), number) / len(batch)
+    return results
+
+
+def end_to_end(p: Params, modes: List[str]) -> Dict[str, dict]:
+    """
+    Renders the whole timelapse once per mode
+
+    :param p: container from bench_params
+    :param modes: any of 'serial', 'pipeline', 'parallel' and 'numpy plot'
+    :return: seconds and frames per second of every mode
+    """
+    from pv_timelapse.create_timelapse import create_timelapse
+
+    options = {'serial': {}, 'pipeline': {'pipeline': True},
+               'parallel': {'frame_workers': max(os.cpu_count() or 1, 2)},
+               'numpy plot': {'plot_renderer': 'numpy'}}
+    results = {}
+    for mode in modes:
+        job = copy(p)
+        for key, value in options[mode].items():
+            setattr(job, key, value)
+        report = create_timelapse(job)
+        results[mode] = {'seconds': report['seconds'],
+                         'frames per second': report['frames per second']}
+    return results
+
+
+def compare(results: dict, baseline: dict,
+            tolerance: float = 0.1) -> List[str]:
+    """
+    Compares results with a baseline run
+
+    :param results: results of this run
+    :param baseline: results of an earlier run
+    :param tolerance: relative change counted as noise
+    :return: a line for every benchmark slower than the baseline beyond the
+        tolerance
+    """
+    regressions = []
+    for name, seconds in results.get('micro', {}).items():
+        before = baseline.get('micro', {}).get(name)
+        if before:
+            change = seconds / before - 1
+            print(f'{name:<28} {before * 1e3:10.3f} ms {seconds * 1e3:10.3f} '
+                  f'ms {change:+8.1%}')
+            if change > tolerance:
+                regressions += [f'{name} is {change:.1%} slower']
+    for mode, run in results.get('end to end', {}).items():
+        before = baseline.get('end to end', {}).get(mode)
+        if before and before['frames per second']:
+            change = before['frames per second'] / \
+                run['frames per second'] - 1
+            print(f'{mode:<28} {before["frames per second"]:9.1f} fps '
+                  f'{run["frames per second"]:9.1f} fps {change:+8.1%}')
+            if change > tolerance:
+                regressions += [f'{mode} is {change:.1%} slower']
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-r', '--root', type=str,
+                        default=os.path.join(tempfile.gettempdir(),
+                                             'pv_timelapse_benchmark'),
+                        help='Directory for the synthetic archive, reused '
+                             'if its settings match')
+    parser.add_argument('--size', type=str, default='1600x1600',
+                        help='Image size as WIDTHxHEIGHT, large enough for the '
+                             'plot at the output resolution')
+    parser.add_argument('--cadence', type=float, default=30,
+                        help='Seconds between images')
+    parser.add_argument('--hours', type=float, default=2,
+                        help='Hours of images per day')
+    parser.add_argument('--days', type=int, default=1,
+                        help='Number of days in the archive')
+    parser.add_argument('--resolution', type=int, default=50,
+                        help='Output resolution as percentage of input')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Video length in seconds')
+    parser.add_argument('-n', '--number', type=int, default=10,
+                        help='Calls per micro-benchmark repeat')
+    parser.add_argument('-m', '--modes', type=str,
+                        default='serial,pipeline,numpy plot',
+                        help='End-to-end modes, comma separated, from '
+                             'serial, pipeline, parallel and numpy plot. '
+                             'Blank to skip.')
+    parser.add_argument('-o', '--output', type=str, default='',
+                        help='JSON file to record the results in')
+    parser.add_argument('-b', '--baseline', type=str, default='',
+                        help='Results of an earlier run to compare against')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='Relative slowdown reported as a regression')
+    in_args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    try:
+        width, height = (int(v) for v in in_args.size.lower().split('x'))
+    except ValueError:
+        sys.exit('Size must be given as WIDTHxHEIGHT')
+    if not plot_fits((height, width), in_args.resolution):
+        sys.exit(f'{in_args.size} images at {in_args.resolution}% are too '
+                 f'small for the {PLOT_SHAPE[1]}x{PLOT_SHAPE[0]} plot')
+    start = datetime(2020, 6, 1, 8)
+    end = start + timedelta(days=in_args.days - 1, hours=in_args.hours)
+    settings = {'size': [height, width], 'cadence': in_args.cadence,
+                'hours': in_args.hours, 'days': in_args.days}
+
+    settings_path = os.path.join(in_args.root, 'settings.json')
+    db_path = os.path.join(in_args.root, 'irradiance.db')
+    # The day folders get a directory of their own, as on the share
+    archive = os.path.join(in_args.root, 'images')
+    try:
+        with open(settings_path) as f:
+            reuse = json.load(f) == settings
+    except (OSError, ValueError):
+        reuse = False
+    if not reuse:
+        print(f'Writing synthetic archive to {in_args.root}')
+        shutil.rmtree(in_args.root, ignore_errors=True)
+        images = make_archive(archive, start, in_args.days,
+                              in_args.hours, in_args.cadence,
+                              (height, width))
+        rows = make_irradiance_db(db_path, start, end)
+        print(f'{images} images, {rows} irradiance rows')
+        with open(settings_path, 'w') as f:
+            json.dump(settings, f)
+
+    output_dir = tempfile.mkdtemp()
+    try:
+        p = bench_params(archive, db_path, start,
+                         start + timedelta(hours=in_args.hours),
+                         in_args.duration, resolution=in_args.resolution,
+                         write=os.path.join(output_dir, 'benchmark.mp4'))
+        results = {'created': datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'cpus': os.cpu_count(),
+                   'settings': dict(settings, resolution=in_args.resolution,
+                                    duration=in_args.duration),
+                   'micro': micro_benchmarks(p, in_args.number)}
+        for name, seconds in results['micro'].items():
+            print(f'{name:<28} {seconds * 1e3:10.3f} ms')
+        modes = [m.strip() for m in in_args.modes.split(',') if m.strip()]
+        if modes and shutil.which('ffmpeg') is None:
+            print('ffmpeg not found, skipping the end-to-end runs')
+            modes = []
+        results['end to end'] = end_to_end(p, modes)
+        for mode, run in results['end to end'].items():
+            print(f'{mode:<28} {run["frames per second"]:9.1f} fps '
+                  f'({run["seconds"]:.1f} s)')
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    if in_args.output:
+        with open(in_args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if in_args.baseline:
+        with open(in_args.baseline) as f:
+            baseline = json.load(f)
+        print(f'\nCompared with {in_args.baseline}')
+        regressions = compare(results, baseline, in_args.tolerance)
+        if regressions:
+            sys.exit('Regressions:\n' + '\n'.join(regressions))
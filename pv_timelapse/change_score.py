@@ -0,0 +1,71 @@
+"""Cheap per-image measures of how much the sky changes"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pv_timelapse.indexing import Params
+from pv_timelapse.loading import load_thumbnail
+
+
+def ghi_change(image_times: pd.DatetimeIndex, ghi_times: np.ndarray,
+               ghi_data: np.ndarray) -> np.ndarray:
+    """
+    Change of the irradiance since the previous image
+
+    :param image_times: sorted dates of the images
+    :param ghi_times: sorted timestamps of the irradiance values
+    :param ghi_data: irradiance values
+    :return: absolute change in W/m² for every image, 0 for the first one
+        and where values are missing
+    """
+    scores = np.zeros(len(image_times))
+    if len(ghi_times) == 0 or len(image_times) < 2:
+        return scores
+    index = np.searchsorted(np.asarray(ghi_times, dtype='datetime64[ns]'),
+                            pd.DatetimeIndex(image_times).to_numpy(),
+                            side='right') - 1
+    ghi = np.asarray(ghi_data, dtype=np.float64)[index.clip(0, None)]
+    scores[1:] = np.nan_to_num(np.abs(np.diff(ghi)))
+    return scores
+
+
+def thumbnail_change(p: Params, image_times: pd.DatetimeIndex,
+                     size: int = 32, threads: int = 2) -> np.ndarray:
+    """
+    Mean absolute difference between the thumbnails of consecutive images.
+    Only 1/8 size versions of JPEGs are decoded.
+
+    :param p: parameter container for the image paths
+    :param image_times: sorted dates of the images
+    :param size: side length of the thumbnails
+    :param threads: threads decoding thumbnails
+    :return: difference in gray levels for every image, 0 for the first one
+    """
+    scores = np.zeros(len(image_times))
+    if len(image_times) < 2:
+        return scores
+    thumbnails = np.empty((len(image_times), size, size), dtype=np.uint8)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for n, thumbnail in enumerate(pool.map(
+                lambda date: load_thumbnail(p.date_to_path(date), size),
+                image_times)):
+            thumbnails[n] = thumbnail
+    diff = np.abs(np.diff(thumbnails.astype(np.int16), axis=0))
+    scores[1:] = diff.reshape(len(diff), -1).mean(axis=1)
+    return scores
+
+
+def change_scores(p: Params, method: str) -> np.ndarray:
+    """
+    Per image change scores of a parameter container's images
+
+    :param p: parameter container with indexed images and irradiance data
+    :param method: 'ghi' or 'thumbnail'
+    :return: the scores
+    """
+    if method == 'ghi':
+        return ghi_change(p.image_times, p.ghi_times, p.ghi_data)
+    if method == 'thumbnail':
+        return thumbnail_change(p, p.image_times, threads=p.decode_threads)
+    raise ValueError(f'Unknown change score: {method}')
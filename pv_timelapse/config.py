@@ -1,7 +1,7 @@
 import configparser
 import os
 import sys
-from typing import Dict, Union
+from typing import Dict, List, Union
 
 
 def configure(file: Union[
@@ -16,17 +16,33 @@ def configure(file: Union[
                 "M:\energy_netzero\photovoltaic_electrical\Images"
                                 "\Sky Camera",
             'output directory': '', 'output name': '%Y-%m-%d.mp4',
-            'overwrite': 'False', 'segmentation output name': '%Y-%m-%d.csv'}
+            'overwrite': 'False', 'segmentation output name': '%Y-%m-%d.npz',
+            'cache directory': 'cache'}
         cfg['Formatting'] = {'image name format': '%Y-%m-%d--%H-%M-%S.jpg',
                              'folder name format': '%Y-%m-%d'}
         cfg['Video Options'] = {'frame rate': '60', 'duration': '10',
-                                'resolution': '50'}
+                                'resolution': '50', 'resampling': 'auto',
+                                'image loader': 'auto',
+                                'frame cache mb': '256',
+                                'plot renderer': 'matplotlib',
+                                'frame selection': 'uniform'}
         cfg['Codec Options'] = {'windows preset': 'False',
                                 'linear time': 'False',
                                 'codec': 'h264', 'quality': '23',
                                 'efficiency': '5',
-                                'custom ffmpeg': '', 'threads': '4'}
-        cfg['Timing'] = {'start day': '-1', 'end day': '-1', 'max days': '10'}
+                                'custom ffmpeg': '', 'threads': '4',
+                                'pipeline': 'False', 'decode threads': '2',
+                                'queue depth': '8',
+                                'intra-day parallel': 'False',
+                                'encoder threads': '0',
+                                'lookahead threads': '0',
+                                'segment frames': '0'}
+        cfg['Timing'] = {'start day': '-1', 'end day': '-1', 'max days': '10',
+                         'image interval': '10'}
+        cfg['Segmentation'] = {'resolution': '25', 'cloud threshold': '0.6'}
+        cfg['Profiling'] = {'report': 'False', 'profiler': 'none'}
+        cfg['Live'] = {'update interval': '300', 'frame step': '1',
+                       'playlist window': '0'}
         cfg['Solar'] = {'latitude': '39.138306', 'longitude': '-77.219444',
                         'time zone': 'America/New_York', 'altitude': '140',
                         'minimum elevation': '-5'}
@@ -46,8 +62,10 @@ def configure(file: Union[
         "; output name: Name of the output file, extension will be removed.\n"
         ";              Supports datetime formatting.\n"
         "; overwrite: replace existing file if present\n"
-        "; segmentation output name: name of CSV file for segmentation data."
-        ";                           Blank to not compute."
+        "; segmentation output name: name of the file for segmentation data,\n"
+        ";                           .npz, .parquet or .csv. Blank to not compute.\n"
+        "; cache directory: Where to keep the image index between runs.\n"
+        ";                  Blank to list the source folders every run.\n\n"
         "; [Formatting]\n"
         "; image name format: Image name format containing date and time information.\n"
         ";                    Use Python's datetime formatting.\n"
@@ -56,7 +74,24 @@ def configure(file: Union[
         "; [Video Options]\n"
         "; frame rate: Frames per second of the output video.\n"
         "; duration: Length of the output video in seconds.\n"
-        "; resolution: Scaling factor; percentage of source resolution.\n\n"
+        "; resolution: Scaling factor; percentage of source resolution.\n"
+        "; resampling: How to scale the images. box averages pixel blocks and\n"
+        ";             needs a resolution dividing 100 (50, 25, 20...), filter\n"
+        ";             works for any resolution, skimage is the slow legacy\n"
+        ";             path and auto picks box when possible, else filter.\n"
+        "; image loader: How to read the images. pil decodes JPEGs directly at\n"
+        ";               1/2, 1/4 or 1/8 size when the resolution allows it,\n"
+        ";               skimage always decodes the full image. auto uses pil\n"
+        ";               when Pillow is installed.\n"
+        "; frame cache mb: Memory in MB for keeping decoded images that are shown\n"
+        ";                 in more than one frame. 0 to disable. Split evenly\n"
+        ";                 between the processes of intra-day parallel.\n"
+        "; plot renderer: How to draw the irradiance plot. matplotlib, or numpy\n"
+        ";                for a faster built-in renderer with a bitmap font.\n"
+        "; frame selection: Which images become frames when linear time is off.\n"
+        ";                  uniform skips images evenly, ghi and thumbnail spend\n"
+        ";                  more frames where the irradiance or the picture\n"
+        ";                  changes faster.\n\n"
         "; [Codec Options]\n"
         "; windows preset: Preset for maximum compatibility with Windows Media Player.\n"
         ";                 Framerate, resolution, and codec options will be ignored.\n"
@@ -67,18 +102,59 @@ def configure(file: Union[
         "; efficiency: Compression efficiency. No effect on quality. Higher efficiency =\n"
         ";             longer encoding time. 0 to 8\n"
         "; threads: how many CPU threads to use in parallel.\n"
+        "; pipeline: Decode, plot and encode frames of a video at the same time.\n"
+        "; decode threads: Threads decoding images for each video in pipeline mode.\n"
+        "; queue depth: Frames buffered between pipeline steps. Bounds memory use.\n"
+        "; intra-day parallel: When there are fewer days than threads, render the\n"
+        ";                     days one after another with every thread working\n"
+        ";                     on the frames of the current day.\n"
+        "; encoder threads: Threads ffmpeg uses to encode each video. 0 splits the\n"
+        ";                  CPU cores evenly between the videos made at once.\n"
+        "; lookahead threads: x264 lookahead threads (h264 only). 0 for the\n"
+        ";                    encoder's default.\n"
+        "; segment frames: Render each video in segments of this many frames,\n"
+        ";                 kept in a .parts folder next to it and joined at the\n"
+        ";                 end. Reruns only render missing or changed segments.\n"
+        ";                 0 to write the video in one piece.\n"
         "; custom ffmpeg: Dict of custom output parameters for FFMPEG. Not recommended.\n\n"
         "; [Timing]\n"
         "; start day: Which day to start making timelapses for. Either a date\n"
         ";            (YYYY-MM-DD) or a negative number. -1 = yesterday\n"
         "; end day: When to stop making timelapses, same options as start day.\n"
-        "; max days: Maximum number of days to make timelapses for.\n\n"
+        "; max days: Maximum number of days to make timelapses for.\n"
+        "; image interval: Seconds between the images of the camera. Used to\n"
+        ";                 estimate how long each day takes to render.\n\n"
+        "; [Segmentation]\n"
+        "; resolution: Percentage of the image resolution to segment at.\n"
+        "; cloud threshold: Red/blue ratio above which a sky pixel is cloud.\n\n"
+        "; [Profiling]\n"
+        "; report: Write the time spent per stage, bytes read, frames per second\n"
+        ";         and queue depths of each video to a JSON file next to it, and\n"
+        ";         the totals of the run to the output directory.\n"
+        "; profiler: none or cprofile to profile each video into a .prof file\n"
+        ";           next to it, readable with pstats or snakeviz.\n\n"
+        "; [Live] (used when started with --watch)\n"
+        "; update interval: Seconds between looking for new images.\n"
+        "; frame step: Use every n-th new image as a frame.\n"
+        "; playlist window: Number of updates kept in the HLS playlist and the\n"
+        ";                  rolling video. 0 to keep the whole day in the\n"
+        ";                  playlist, without a rolling video.\n\n"
         "; [Solar]\n"
         "; latitude: of the solar panel location in decimal degree form.\n"
         "; longitude: in decimal degree form.\n"
         "; altitude: above sea level in meters.\n"
         "; time zone: name from the tz database (e.g. America/New_York)\n"
         "; minimum elevation: Solar zenith angle to use as the start of the timelapse.\n\n"
+        "; [Output <name>] (optional, any number of sections)\n"
+        "; Further videos rendered from the same decoded images as the main one.\n"
+        "; output name: Name of the video, extension will be removed. Supports\n"
+        ";              datetime formatting.\n"
+        "; resolution, duration, frame rate, codec, quality, efficiency: as above,\n"
+        ";              taken from [Video Options] and [Codec Options] if left out.\n"
+        "; span: day for a video of every day, decoded together with the\n"
+        ";       main one, or run for one video of all days of the run,\n"
+        ";       e.g. a weekly summary, rendered as a job of its own.\n"
+        ";       Only day outputs are made with --watch.\n\n"
         "; [Database]\n"
         "; host: SQL host containing a table with irradiance information.\n"
         "; port: corresponding to the host.\n"
@@ -102,8 +178,54 @@ def configure(file: Union[
         sys.exit('Invalid quality value. Must be 0 to 8.')
     if cfg.getint('Codec Options', 'efficiency') not in range(9):
         sys.exit('Invalid efficiency value. Must be 0 to 8.')
+    if cfg.getint('Codec Options', 'decode threads', fallback=2) <= 0 or \
+            cfg.getint('Codec Options', 'queue depth', fallback=8) <= 0:
+        sys.exit('Decode threads and queue depth must be positive')
+    if cfg.getint('Codec Options', 'encoder threads', fallback=0) < 0 or \
+            cfg.getint('Codec Options', 'lookahead threads', fallback=0) < 0:
+        sys.exit('Encoder and lookahead threads cannot be negative')
+    if cfg.getfloat('Live', 'update interval', fallback=300) <= 0 or \
+            cfg.getint('Live', 'frame step', fallback=1) <= 0 or \
+            cfg.getint('Live', 'playlist window', fallback=0) < 0:
+        sys.exit('Invalid live options')
+    if not 0 < cfg.getint('Segmentation', 'resolution', fallback=25) <= 100:
+        sys.exit('Segmentation resolution must be between 1 and 100')
+    if cfg.getfloat('Segmentation', 'cloud threshold', fallback=0.6) <= 0:
+        sys.exit('Cloud threshold must be positive')
+    if cfg.get('Profiling', 'profiler', fallback='none') not in \
+            ('none', 'cprofile'):
+        sys.exit('Profiler must be none or cprofile')
+    if cfg.getint('Codec Options', 'segment frames', fallback=0) < 0:
+        sys.exit('Segment frames cannot be negative')
+    if cfg.getfloat('Timing', 'image interval', fallback=10) <= 0:
+        sys.exit('Image interval must be positive')
+    if cfg.getfloat('Video Options', 'frame cache mb', fallback=0) < 0:
+        sys.exit('Invalid frame cache size')
     if cfg.getint('Video Options', 'resolution') <= 0:
         sys.exit('Invalid resolution')
+    if cfg.get('Video Options', 'resampling', fallback='auto') not in \
+            ['auto', 'box', 'filter', 'skimage']:
+        sys.exit('Invalid resampling method')
+    if cfg.get('Video Options', 'image loader', fallback='auto') not in \
+            ['auto', 'pil', 'skimage']:
+        sys.exit('Invalid image loader')
+    if cfg.get('Video Options', 'plot renderer',
+               fallback='matplotlib') not in ['matplotlib', 'numpy']:
+        sys.exit('Invalid plot renderer')
+    if cfg.get('Video Options', 'frame selection', fallback='uniform') not in \
+            ['uniform', 'ghi', 'thumbnail']:
+        sys.exit('Invalid frame selection')
+    for section in output_sections(cfg):
+        if not cfg.get(section, 'output name', fallback=''):
+            sys.exit(f'[{section}] needs an output name')
+        output = _output_config(cfg, section)
+        if output['Codec Options']['codec'] not in ['h265', 'h264'] or \
+                output.getint('Codec Options', 'quality') not in range(52) or \
+                output.getint('Codec Options', 'efficiency') not in range(9) \
+                or output.getint('Video Options', 'resolution') <= 0 or \
+                output.getfloat('Video Options', 'duration') <= 0 or \
+                cfg.get(section, 'span', fallback='day') not in ['day', 'run']:
+            sys.exit(f'Invalid options in [{section}]')
     if not os.path.isdir(cfg['Files']['source directory']):
         sys.exit('Source directory not found')
     return cfg
@@ -135,7 +257,103 @@ def create_dict(cfg: configparser.ConfigParser) -> Dict[str, dict]:
                        '-preset': efficiency[cfg.getint('Codec Options',
                                                         'efficiency')],
                        '-crf': cfg['Codec Options']['quality']}
+        lookahead = cfg.getint('Codec Options', 'lookahead threads',
+                               fallback=0)
+        if lookahead and cfg['Codec Options']['codec'] == 'h264':
+            output_dict['-x264-params'] = f'lookahead-threads={lookahead}'
+
+    encoder_threads = cfg.getint('Codec Options', 'encoder threads',
+                                 fallback=0)
+    if encoder_threads == 0:
+        # Every pool thread runs its own encoder, so share the cores
+        encoder_threads = max((os.cpu_count() or 1) //
+                              cfg.getint('Codec Options', 'threads',
+                                         fallback=1), 1)
+    output_dict['-threads'] = str(encoder_threads)
     return {'out': output_dict, 'in': input_dict}
 
+
+def output_sections(cfg: configparser.ConfigParser) -> List[str]:
+    """Names of the [Output ...] sections describing further videos"""
+    return [section for section in cfg.sections()
+            if section.startswith('Output ')]
+
+
+def _output_config(cfg: configparser.ConfigParser,
+                   section: str) -> configparser.ConfigParser:
+    """
+    The configuration with the video and codec options of an output section
+    in place of the main ones
+    """
+    output = configparser.ConfigParser(interpolation=None)
+    output.read_dict(cfg)
+    for key in ['resolution', 'duration', 'frame rate']:
+        if cfg.has_option(section, key):
+            output['Video Options'][key] = cfg[section][key]
+    for key in ['codec', 'quality', 'efficiency']:
+        if cfg.has_option(section, key):
+            output['Codec Options'][key] = cfg[section][key]
+    return output
+
+
+def create_outputs(cfg: configparser.ConfigParser) -> List[dict]:
+    """
+    Collects the further videos of the [Output ...] sections
+
+    :param cfg: loaded configuration file
+    :return: for every output its name format, its span and the keyword
+        arguments for outputs.OutputSpec apart from the path
+    """
+    outputs = []
+    for section in output_sections(cfg):
+        output = _output_config(cfg, section)
+        dicts = create_dict(output)
+        outputs += [{'name': cfg[section]['output name'],
+                     'span': cfg.get(section, 'span', fallback='day'),
+                     'resolution': output.getint('Video Options',
+                                                 'resolution'),
+                     'duration': output.getfloat('Video Options', 'duration'),
+                     'input_dict': dicts['in'],
+                     'output_dict': dicts['out']}]
+    return outputs
+
+
+def create_options(cfg: configparser.ConfigParser) -> dict:
+    """
+    Collects the optional Params keyword arguments from the configuration.
+    Missing entries fall back to their defaults so older files keep working.
+
+    :param cfg: loaded configuration file
+    :return: keyword arguments for Params
+    """
+    cache_dir = cfg.get('Files', 'cache directory', fallback='')
+    return {'cache_dir': os.path.abspath(cache_dir) if cache_dir else None,
+            'resampling': cfg.get('Video Options', 'resampling',
+                                  fallback='auto'),
+            'loader': cfg.get('Video Options', 'image loader',
+                              fallback='auto'),
+            'cache_mb': cfg.getfloat('Video Options', 'frame cache mb',
+                                     fallback=0),
+            'plot_renderer': cfg.get('Video Options', 'plot renderer',
+                                     fallback='matplotlib'),
+            'frame_selection': cfg.get('Video Options', 'frame selection',
+                                       fallback='uniform'),
+            'pipeline': cfg.getboolean('Codec Options', 'pipeline',
+                                       fallback=False),
+            'decode_threads': cfg.getint('Codec Options', 'decode threads',
+                                         fallback=2),
+            'queue_depth': cfg.getint('Codec Options', 'queue depth',
+                                      fallback=8),
+            'segment_frames': cfg.getint('Codec Options', 'segment frames',
+                                         fallback=0),
+            'seg_resolution': cfg.getint('Segmentation', 'resolution',
+                                         fallback=25),
+            'cloud_threshold': cfg.getfloat('Segmentation', 'cloud threshold',
+                                            fallback=0.6),
+            'image_interval': cfg.getfloat('Timing', 'image interval',
+                                           fallback=10),
+            'report': cfg.getboolean('Profiling', 'report', fallback=False),
+            'profiler': cfg.get('Profiling', 'profiler', fallback='none')}
+
 if __name__ == '__main__':
     configure()
\ No newline at end of file
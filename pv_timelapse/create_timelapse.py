@@ -1,87 +1,116 @@
 import argparse
+import cProfile
 import logging
 import os
 import sys
-import warnings
-import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import numpy as np
-import pandas as pd
-from skimage.io import imread
-
-with warnings.catch_warnings():
-    warnings.simplefilter('ignore')
-    from skvideo.io import FFmpegWriter
-
-from pv_timelapse.frame_tools import process_frame
+from pv_timelapse.frame_cache import FrameCache
+from pv_timelapse.frame_plan import FramePlan
+from pv_timelapse.frame_tools import reset_frame_shape
 from pv_timelapse.indexing import ProgressBar, Params
-from pv_timelapse.plotting import plot_ghi
-from pv_timelapse.config import configure, create_dict
+from pv_timelapse.config import configure, create_dict, create_options
+from pv_timelapse.instrumentation import job_report, stats, write_report
+from pv_timelapse.outputs import OutputSpec, render_outputs
+from pv_timelapse.rendering import render_frames
 from pv_timelapse.segmentation import compute_segmentation
+from pv_timelapse.segments import render_segments
+from pv_timelapse.video_writer import PipeWriter
 
 
-def create_timelapse(p: Params):
+def create_timelapse(p: Params) -> dict:
     """
     Creates a time-lapse.
 
     :param p: Params container class for the timelapse
+    :return: timing report of the job, see instrumentation.job_report
     """
-    total_frames = p.duration * int(p.input_dict['-r'])
-    frame_times = np.linspace(pd.Timestamp(p.start_date).value,
-                              pd.Timestamp(p.end_date).value, total_frames)
-
-    frame_times = pd.to_datetime(frame_times)
-    # Framerate has to be a string
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore')
-        frame_writer = FFmpegWriter(p.write, inputdict=p.input_dict,
-                                    outputdict=p.output_dict)
-    if not p.image_times:
+    stats.reset()
+    profiler = cProfile.Profile() if p.profiler == 'cprofile' else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        _create_timelapse(p)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(p.write + '.prof')
+    report = job_report(p, time.perf_counter() - start)
+    if p.report:
+        write_report(report, p.write + '.stats.json')
+    return report
+
+
+def _create_timelapse(p: Params):
+    # Pool workers render several videos, each sized by its first frame
+    reset_frame_shape()
+    if len(p.image_times) == 0:
         p.image_indexing()
 
-    if p.seg_write:
-        csv_file = open(p.seg_write, 'w', newline='')
-        csv_writer = csv.writer(csv_file, dialect='excel',
-                                quoting=csv.QUOTE_ALL)
-
-    f_count = 0
     if p.show_pbar:
         pbar = ProgressBar()
+    if len(p.image_times) == 0 and p.day_folders == []:
+        logging.warning(f'Missing folder for {p.start_date:%Y-%m-%d}')
+        return
     if len(p.image_times) == 0:
         logging.critical(f'Missing images for {p.start_date}')
         return
-    if p.linear_time or (len(frame_times) > len(p.image_times)):
-        for frame in frame_times:
-            closest_img = p.image_times.get_loc(frame, method='nearest')
-            img_date = p.image_times[closest_img]
-            frame_image = imread(p.date_to_path(img_date))
-            plot = plot_ghi(p, img_date)
-            to_writer = process_frame(frame_image, p.resolution, plot)
-            if p.seg_write:
-                compute_segmentation(frame_image, img_date, csv_writer)
-            frame_writer.writeFrame(to_writer)
-            f_count += 1
-            if p.show_pbar:
-                pbar.update(f_count / len(frame_times))
-    else:
-        skip = int(len(p.image_times) / len(frame_times))
-        for n in range(0, len(p.image_times), skip):
-            img_date = p.image_times[n]
-            plot = plot_ghi(p, img_date)
-            frame_image = imread(p.date_to_path(img_date))
-            to_writer = process_frame(frame_image, p.resolution, plot)
-            if p.seg_write:
-                compute_segmentation(frame_image, img_date, csv_writer)
-            frame_writer.writeFrame(to_writer)
-            if p.show_pbar:
-                pbar.update((n + 1) / len(p.image_times))
+    plan = FramePlan.from_params(p)
+    cache = FrameCache(p.cache_mb)
+    progress = pbar.update if p.show_pbar else None
+
+    # Segmentation covers every image, so it runs as its own stage next to
+    # the rendering instead of on the frames of the video
+    seg_pool = None
+    segmentation = None
+    if p.seg_write:
+        seg_pool = ThreadPoolExecutor(max_workers=1)
+        segmentation = seg_pool.submit(compute_segmentation, p)
+    try:
+        if p.outputs and (p.pipeline or p.frame_workers > 1):
+            logging.warning(f'{p.write}: the pipeline and frame workers do '
+                            f'not apply to further outputs, their images are '
+                            f'decoded on {p.decode_threads} threads instead')
+        if p.outputs and p.segment_frames > 0:
+            # Keeps this video resumable at the cost of decoding its images
+            # a second time for the further outputs
+            logging.info(f'{p.write}: rendering in segments, further outputs '
+                         f'decode their images separately')
+            render_segments(
+                p, plan, p.segment_frames,
+                None if progress is None else lambda f: progress(f / 2), cache)
+            render_outputs(
+                p, p.outputs,
+                None if progress is None else lambda f: progress(0.5 + f / 2),
+                cache)
+        elif p.outputs:
+            # One decode pass for this video and the further outputs
+            render_outputs(p, [OutputSpec(p.write)] + p.outputs, progress,
+                           cache)
+        elif p.segment_frames > 0:
+            render_segments(p, plan, p.segment_frames, progress, cache)
+        else:
+            frame_writer = PipeWriter(p.write, p.input_dict, p.output_dict)
+            try:
+                render_frames(p, plan, frame_writer, progress, cache)
+            finally:
+                frame_writer.close()
+    finally:
+        if seg_pool is not None:
+            seg_pool.shutdown()
+    if segmentation is not None:
+        segmentation.result()
     if p.show_pbar:
         pbar.update(1)
 
-    if p.seg_write:
-        csv_file.close()
-    frame_writer.close()
+    if cache.hits + cache.misses:
+        logging.info(f'Frame cache for {p.write}: {cache.stats()}')
+    stats.count('frame cache hits', cache.hits)
+    stats.count('frame cache misses', cache.misses)
+
 
 if __name__ == '__main__':
     """Running the timelapse creation script by itself"""
@@ -145,7 +174,7 @@ if __name__ == '__main__':
                    cfg['Database']['host'], cfg.getint('Database', 'port'),
                    cfg['Database']['database'], cfg['Database']['table name'],
                    cfg['Database']['table column'],
-                   cfg['Database']['time column'])
+                   cfg['Database']['time column'], **create_options(cfg))
         p.set_dates(start_datetime, end_datetime, write_path)
         create_timelapse(p)
     except Exception as e:
@@ -0,0 +1,94 @@
+"""Memory-bounded LRU cache of decoded and scaled source images"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from pv_timelapse.indexing import Params
+from pv_timelapse.loading import load_frame
+
+
+class FrameCache:
+    """
+    Keeps recently loaded frames, keyed by image date and resolution, until
+    their total size exceeds a budget in megabytes. Least recently used
+    frames are dropped first. Safe to share between threads.
+    """
+
+    def __init__(self, budget_mb: float):
+        """
+        :param budget_mb: memory budget in megabytes, 0 to cache nothing
+        """
+        self.budget = int(budget_mb * 2 ** 20)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> np.ndarray:
+        """
+        Looks up a frame and marks it as recently used
+
+        :param key: cache key
+        :return: the frame, None if it is not cached
+        """
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key: tuple, frame: np.ndarray):
+        """
+        Stores a frame, evicting old ones to stay within the budget. Frames
+        larger than the whole budget are not stored.
+
+        :param key: cache key
+        :param frame: the frame, made read-only as it will be shared
+        """
+        if frame.nbytes > self.budget:
+            return
+        frame.flags.writeable = False
+        with self._lock:
+            if key in self._frames:
+                self.size -= self._frames.pop(key).nbytes
+            self._frames[key] = frame
+            self.size += frame.nbytes
+            while self.size > self.budget:
+                _, old = self._frames.popitem(last=False)
+                self.size -= old.nbytes
+                self.evictions += 1
+
+    def load(self, p: Params, img_date: datetime) -> np.ndarray:
+        """
+        Returns the scaled image for a date, loading it on a miss
+
+        :param p: parameter container
+        :param img_date: date of the image
+        :return: the read-only scaled uint8 frame
+        """
+        key = (pd.Timestamp(img_date).value, p.resolution)
+        frame = self.get(key)
+        if frame is None:
+            frame = load_frame(p.date_to_path(img_date), p.resolution,
+                               p.loader, p.resampling)
+            self.put(key, frame)
+        return frame
+
+    def stats(self) -> dict:
+        """Hit and miss counters and the memory in use"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit rate': self.hits / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'entries': len(self._frames),
+                    'size mb': self.size / 2 ** 20,
+                    'budget mb': self.budget / 2 ** 20}
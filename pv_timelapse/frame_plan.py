@@ -0,0 +1,157 @@
+"""Resolves which source image every output frame shows"""
+from typing import Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pv_timelapse.change_score import change_scores
+from pv_timelapse.indexing import Params
+
+
+def _as_ns(times) -> pd.DatetimeIndex:
+    """
+    Dates in nanoseconds, so their int64 values compare whatever unit pandas
+    picked for them
+    """
+    return pd.DatetimeIndex(
+        pd.DatetimeIndex(times).to_numpy().astype('datetime64[ns]'))
+
+
+class FramePlan:
+    """
+    Maps every output frame to a source image. The whole schedule is
+    resolved upfront so the render loops only have to walk it.
+    """
+
+    def __init__(self, image_times: pd.DatetimeIndex,
+                 image_index: np.ndarray, frame_times: pd.DatetimeIndex = None):
+        """
+        :param image_times: sorted dates of the available images
+        :param image_index: index into image_times for every output frame
+        :param frame_times: date every frame stands for, defaults to the
+            date of its image
+        """
+        self.image_times = _as_ns(image_times)
+        self.image_index = np.asarray(image_index, dtype=np.intp)
+        if frame_times is None:
+            frame_times = self.image_times[self.image_index]
+        self.frame_times = _as_ns(frame_times)
+
+    @classmethod
+    def nearest(cls, image_times: pd.DatetimeIndex,
+                frame_times: pd.DatetimeIndex) -> 'FramePlan':
+        """
+        Shows the image closest in time for every frame
+
+        :param image_times: sorted dates of the available images
+        :param frame_times: dates of the output frames
+        :return: the plan
+        """
+        images = _as_ns(image_times).asi8
+        frames = _as_ns(frame_times).asi8
+        right = np.searchsorted(images, frames).clip(0, len(images) - 1)
+        left = (right - 1).clip(0, None)
+        # Ties go to the later image, as pandas' nearest lookup did
+        take_left = np.abs(frames - images[left]) < \
+            np.abs(images[right] - frames)
+        return cls(image_times, np.where(take_left, left, right), frame_times)
+
+    @classmethod
+    def every_nth(cls, image_times: pd.DatetimeIndex,
+                  total_frames: int) -> 'FramePlan':
+        """
+        Shows every n-th image so that at least total_frames frames are used
+
+        :param image_times: sorted dates of the available images
+        :param total_frames: number of frames wanted
+        :return: the plan
+        """
+        skip = max(int(len(image_times) / total_frames), 1)
+        return cls(image_times, np.arange(0, len(image_times), skip))
+
+    @classmethod
+    def adaptive(cls, image_times: pd.DatetimeIndex, scores: np.ndarray,
+                 total_frames: int, uniform: float = 0.25) -> 'FramePlan':
+        """
+        Spends the frames where the scores are high. Every image gets a
+        weight mixing its share of the total score with an even share; the
+        frames are spread evenly over the cumulative weight, so calm
+        stretches skip images and fast changes show every one of them, or
+        hold them for several frames.
+
+        :param image_times: sorted dates of the available images
+        :param scores: change score of every image, e.g. from change_score
+        :param total_frames: number of frames
+        :param uniform: share of the frames spread evenly over the images
+        :return: the plan
+        """
+        scores = np.nan_to_num(np.asarray(scores, dtype=np.float64)).clip(
+            0, None)
+        weights = np.full(len(scores), 1 / len(scores))
+        if scores.sum() > 0:
+            weights = uniform * weights + (1 - uniform) * scores / scores.sum()
+        edges = np.cumsum(weights)
+        targets = (np.arange(total_frames) + 0.5) / total_frames * edges[-1]
+        index = np.searchsorted(edges, targets).clip(0, len(scores) - 1)
+        return cls(image_times, index)
+
+    @classmethod
+    def from_params(cls, p: Params) -> 'FramePlan':
+        """
+        The plan for a timelapse: evenly spaced frame times for linear time
+        or when there are fewer images than frames, frames spread by change
+        score if a frame selection is set, every n-th image otherwise
+
+        :param p: parameter container with indexed images
+        :return: the plan
+        """
+        total_frames = int(p.duration * int(p.input_dict['-r']))
+        if not p.linear_time and p.frame_selection != 'uniform' and \
+                len(p.image_times):
+            return cls.adaptive(p.image_times,
+                                change_scores(p, p.frame_selection),
+                                total_frames)
+        frame_times = pd.to_datetime(np.linspace(
+            pd.Timestamp(p.start_date).value, pd.Timestamp(p.end_date).value,
+            total_frames))
+        if p.linear_time or (len(frame_times) > len(p.image_times)):
+            return cls.nearest(p.image_times, frame_times)
+        return cls.every_nth(p.image_times, total_frames)
+
+    def __len__(self) -> int:
+        return len(self.image_index)
+
+    @property
+    def img_dates(self) -> pd.DatetimeIndex:
+        """Date of the image shown in every frame"""
+        return self.image_times[self.image_index]
+
+    @property
+    def gaps(self) -> pd.TimedeltaIndex:
+        """Time between every frame and the image it shows"""
+        return pd.TimedeltaIndex(np.abs(self.frame_times.asi8 -
+                                        self.img_dates.asi8))
+
+    def runs(self) -> Iterator[Tuple[int, int, int]]:
+        """
+        Groups consecutive frames showing the same image
+
+        :return: iterator of (image index, first frame, number of frames)
+        """
+        if len(self) == 0:
+            return
+        starts = np.flatnonzero(np.diff(self.image_index)) + 1
+        starts = np.concatenate([[0], starts])
+        counts = np.diff(np.concatenate([starts, [len(self)]]))
+        for start, count in zip(starts, counts):
+            yield int(self.image_index[start]), int(start), int(count)
+
+    def unique_images(self) -> int:
+        """Number of image decodes the plan needs"""
+        return int(np.count_nonzero(np.diff(self.image_index))) + \
+            (len(self) > 0)
+
+    def __getitem__(self, item: slice) -> 'FramePlan':
+        """A plan for a range of the frames"""
+        return FramePlan(self.image_times, self.image_index[item],
+                         self.frame_times[item])
@@ -1,51 +1,239 @@
 import warnings
+from typing import List, Tuple
 
 import numpy as np
 from skimage import img_as_ubyte
-from skimage.transform import rescale, resize
+
+from pv_timelapse.instrumentation import stats
+from pv_timelapse.resampling import resize_frame, scale_frame
 
 initial_res = (0, 0, 0)
+_compositor = None
+
+
+def reset_frame_shape():
+    """
+    Forgets the frame shape fixed by the first frame, so the next video of
+    this process gets the shape of its own first frame
+    """
+    global initial_res, _compositor
+    initial_res = (0, 0, 0)
+    _compositor = None
 
 
 def process_frame(frame: np.ndarray, resolution: int,
-                  plot: np.ndarray) -> np.ndarray:
+                  plot: np.ndarray, resampling: str = 'auto',
+                  out: np.ndarray = None,
+                  mask: 'OverlayMask' = None) -> np.ndarray:
     """
     Performs various operations on a frame.
 
+    Without out, the returned frame is a buffer owned by this module and is
+    overwritten by the next call. Copy it if it has to outlive the next frame.
+
     :param frame: the video frame to process
     :param resolution: percentage to scale the frame by
     :param plot: image of the plot to superimpose
+    :param resampling: resampling method, see resampling.scale_frame
+    :param out: frame previously returned by this function to reuse as the
+        output
+    :param mask: where the plot can be non-black, see plotting.plot_mask
     :return: the processed frame
     """
-    if resolution is not 100:
-        scale = resolution / 100
-        frame = rescale(frame, scale, mode='constant')
-    global initial_res
+    with stats.stage('composite'):
+        return _process_frame(frame, resolution, plot, resampling, out, mask)
+
+
+def _process_frame(frame: np.ndarray, resolution: int, plot: np.ndarray,
+                   resampling: str, out: np.ndarray,
+                   mask: 'OverlayMask') -> np.ndarray:
+    frame = scale_frame(frame, resolution, resampling)
+    global initial_res, _compositor
     if initial_res == (0, 0, 0):
         initial_res = frame.shape
     frame_res = frame.shape
     if frame_res != initial_res:
-        frame = resize(frame, initial_res)
-    frame = horizontal_pad(frame)
-    frame = overlay(frame, plot)
+        frame = resize_frame(frame, initial_res, resampling)
     with warnings.catch_warnings():
         warnings.simplefilter('ignore')
         # FFMPEG requires uint8 images as input
-        return img_as_ubyte(frame)
+        frame = img_as_ubyte(frame)
+        plot = img_as_ubyte(plot)
+    if _compositor is None or not _compositor.fits(frame, plot):
+        _compositor = Compositor(frame.shape, plot.shape)
+    return _compositor.compose(frame, plot, out, mask)
+
+
+class OverlayMask:
+    """
+    Non-black pixels of overlay images that share a static background and
+    only change inside a few boxes. The background is scanned once, every
+    image only inside the boxes.
+    """
+
+    def __init__(self, background: np.ndarray, boxes: List[Tuple[slice,
+                                                                 slice]]):
+        """
+        :param background: overlay image without the changing parts
+        :param boxes: row and column slices of the changing parts, clipped
+            to the image
+        """
+        self.shape = background.shape
+        self.boxes = [tuple(slice(*s.indices(n)[:2]) for s, n
+                            in zip(box, background.shape[:2]))
+                      for box in boxes]
+        static = background.any(axis=2)
+        for rows, cols in self.boxes:
+            static[rows, cols] = False
+        self.static = np.nonzero(static)
+
+    def index(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Row and column indices of the non-black pixels of an image
+
+        :param image: overlay image on the background of this mask
+        :return: row and column index arrays
+        """
+        rows, cols = [self.static[0]], [self.static[1]]
+        for box_rows, box_cols in self.boxes:
+            found = np.nonzero(image[box_rows, box_cols].any(axis=2))
+            rows += [found[0] + box_rows.start]
+            cols += [found[1] + box_cols.start]
+        return np.concatenate(rows), np.concatenate(cols)
+
+
+class Compositor:
+    """Pads frames and overlays a plot into a preallocated output frame"""
+
+    def __init__(self, frame_shape: tuple, image_shape: tuple,
+                 position: tuple = (0, 0), buffer: int = 2,
+                 width_scale: float = 0.19375):
+        """
+        Allocates the output frame and precomputes where the overlay goes
 
+        :param frame_shape: shape of the unpadded uint8 frames
+        :param image_shape: shape of the image to overlay
+        :param position: where to overlay: (0,0) for bottom left
+        :param buffer: how many pixels away from the border to overlay
+        :param width_scale: amount to pad, as multiple of the frame width
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.image_shape = tuple(image_shape)
+        self.pad_width = int(frame_shape[1] * width_scale)
+        self.out = self.new_buffer()
+        self.frame_cols = slice(self.pad_width,
+                                self.pad_width + frame_shape[1])
+        self.rows, self.cols = overlay_slices(self.out.shape, image_shape,
+                                              position, buffer)
 
-def horizontal_pad(frame: np.ndarray, width_scale: float = 0.19375):
+    def new_buffer(self) -> np.ndarray:
+        """
+        Allocates a black output frame this compositor can write into
+
+        :return: the output frame
+        """
+        return np.zeros((self.frame_shape[0],
+                         self.frame_shape[1] + 2 * self.pad_width, 3),
+                        dtype=np.uint8)
+
+    def fits(self, frame: np.ndarray, image: np.ndarray) -> bool:
+        """
+        Whether a frame and overlay image match the precomputed layout
+
+        :param frame: unpadded frame
+        :param image: image to overlay
+        """
+        return (frame.shape == self.frame_shape and
+                image.shape == self.image_shape)
+
+    @staticmethod
+    def mask_index(image: np.ndarray, mask: OverlayMask = None) -> Tuple[
+            np.ndarray, np.ndarray]:
+        """
+        Row and column indices of the non-black pixels of the overlay image.
+        With a mask only its changing boxes are scanned.
+
+        :param image: image to overlay
+        :param mask: mask of the renderer that drew the image
+        :return: row and column index arrays
+        """
+        if mask is not None and mask.shape == image.shape:
+            return mask.index(image)
+        return np.nonzero(image.any(axis=2))
+
+    def compose(self, frame: np.ndarray, image: np.ndarray,
+                out: np.ndarray = None,
+                mask: OverlayMask = None) -> np.ndarray:
+        """
+        Writes the padded frame with the overlay into the output frame
+
+        :param frame: unpadded uint8 frame
+        :param image: uint8 image to overlay, transparent where black
+        :param out: output frame from new_buffer or an earlier compose call to
+            write into instead of the compositor's own
+        :param mask: mask of the renderer that drew the image
+        :return: the output frame
+        """
+        if out is None:
+            out = self.out
+        out[::, self.frame_cols] = frame
+        region = out[self.rows, self.cols]
+        # The overlay may reach into the padding, which has to be black again
+        # before the next overlay
+        region[::, :max(self.pad_width - self.cols.start, 0)] = 0
+        region[::, max(self.frame_cols.stop - self.cols.start, 0):] = 0
+        rows, cols = self.mask_index(image, mask)
+        region[rows, cols] = image[rows, cols]
+        return out
+
+
+def overlay_slices(back_shape: tuple, image_shape: tuple,
+                   position: tuple = (0, 0),
+                   buffer: int = 2) -> Tuple[slice, slice]:
+    """
+    Finds the region of the background covered by an overlay
+
+    :param back_shape: shape of the background
+    :param image_shape: shape of the image to overlay
+    :param position: where to overlay: (0,0) for bottom left, (0,1) for
+        bottom right, (1,1) for top right and (1,0) for top left
+    :param buffer: how many pixels away from the border to overlay
+    :return: row and column slices of the background
+    """
+    if any([a + buffer > b for (a, b) in zip(image_shape[:2],
+                                             back_shape[:2])]):
+        raise ValueError('Overlay image too large')
+    if position not in [(0, 0), (0, 1), (1, 1), (1, 0)]:
+        raise ValueError('Invalid overlay position')
+    dim = image_shape
+    if position[0] == 0:
+        rows = slice(back_shape[0] - buffer - dim[0], back_shape[0] - buffer)
+    else:
+        rows = slice(buffer, dim[0] + buffer)
+    if position[1] == 0:
+        cols = slice(buffer, dim[1] + buffer)
+    else:
+        cols = slice(back_shape[1] - buffer - dim[1], back_shape[1] - buffer)
+    return rows, cols
+
+
+def horizontal_pad(frame: np.ndarray, width_scale: float = 0.19375,
+                   out: np.ndarray = None) -> np.ndarray:
     """
     Pads the image horizontally with black.
 
     :param frame: the frame to pad
     :param width_scale: amount to pad, as multiple of current width
+    :param out: preallocated black output frame to write into
     :return: the padded frame
     """
     shape = frame.shape
     pad_width = int(shape[1] * width_scale)
-    frame = np.pad(frame, ((0, 0), (pad_width, pad_width), (0, 0)), 'constant')
-    return frame
+    if out is None:
+        out = np.zeros((shape[0], shape[1] + 2 * pad_width) + shape[2:],
+                       dtype=frame.dtype)
+    out[::, pad_width:pad_width + shape[1]] = frame
+    return out
 
 
 def overlay(background: np.ndarray, image: np.ndarray,
@@ -65,39 +253,9 @@ def overlay(background: np.ndarray, image: np.ndarray,
         # undesired results
         background = img_as_ubyte(background)
         image = img_as_ubyte(image)
-    mask = np.logical_and(image[::, ::, 0] == 0, np.logical_and(
-        image[::, ::, 1] == 0, image[::, ::, 2] == 0))
-    mask = mask.astype(bool)
-    mask = ~np.dstack((mask, mask, mask))
-
-    size = [n + buffer for n in image.shape]
-    back_size = list(background.shape)
-    if all([a > b for (a, b) in zip(size, back_size)]):
-        raise ValueError('Overlay image too large')
-
-    dim = image.shape
-    if position == (0, 0):
-        back_slice = background[-buffer - dim[0]:-buffer:,
-                     buffer:dim[1] + buffer:, ::]
-        back_slice[mask] = image[mask]
-        background[-buffer - dim[0]:-buffer:, buffer:dim[1] + buffer:, ::]\
-            = back_slice
-    elif position == (0, 1):
-        back_slice = background[-dim[0] - buffer:-buffer:,
-                     -dim[1] - buffer:-buffer:, ::]
-        back_slice[mask] = image[mask]
-        background[-dim[0] - buffer:-buffer:, -dim[1] - buffer:-buffer:,
-        ::] = back_slice
-    elif position == (1, 1):
-        back_slice = background[buffer:dim[0] + buffer:,
-                     -dim[1] - buffer:-buffer:, ::]
-        back_slice[mask] = image[mask]
-        background[buffer:dim[0] + buffer:, -dim[1] - buffer:-buffer:,
-        ::] = back_slice
-    elif position == (1, 0):
-        back_slice = background[buffer:dim[0] + buffer:,
-                     buffer:dim[1] + buffer:, ::]
-        back_slice[mask] = image[mask]
-        background[buffer:dim[0] + buffer:, buffer:dim[1] + buffer:,
-        ::] = back_slice
+    rows, cols = overlay_slices(background.shape, image.shape, position,
+                                buffer)
+    mask = image.any(axis=2)
+    # Basic slicing gives a view, so this writes straight into the background
+    np.copyto(background[rows, cols], image, where=mask[::, ::, np.newaxis])
     return background
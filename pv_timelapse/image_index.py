@@ -0,0 +1,120 @@
+"""Persistent on-disk index of the day folders and image timestamps"""
+import hashlib
+import logging
+import os
+import time
+from typing import Tuple
+
+import numpy as np
+
+from pv_timelapse.name_parsing import parse_names
+
+# Network shares often store modification times with one or two second
+# resolution. Listings taken that close to the last change are rescanned.
+_MTIME_SLACK = 2.0
+
+
+class ImageIndex:
+    """
+    Caches the dates parsed from the folder and image names of a source
+    directory. Every listing is stored with its directory's modification time
+    and only listed again once that changes. Names already parsed are not
+    parsed again, so a growing folder of the current day only costs the new
+    files.
+    """
+    logger = logging.getLogger('Indexing')
+
+    def __init__(self, source_path: os.path.abspath, folder_format: str,
+                 image_name_format: str, cache_dir: os.path.abspath):
+        """
+        :param source_path: directory containing the day folders
+        :param folder_format: name format of the day folders
+        :param image_name_format: name format of the individual images
+        :param cache_dir: directory to keep the index files in
+        """
+        self.source = source_path
+        self.folder_format = folder_format
+        self.image_name_format = image_name_format
+        key = hashlib.sha1('\n'.join([os.path.abspath(source_path),
+                                      folder_format, image_name_format])
+                           .encode()).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir, 'index_' + key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, name: str) -> os.path.abspath:
+        return os.path.join(self.cache_dir, name + '.npz')
+
+    def _lookup(self, path: os.path.abspath, entry: str,
+                name_format: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the parsed names of a directory, from the cache if it is
+        still valid
+
+        :param path: directory to list
+        :param entry: name of the cache file
+        :param name_format: datetime format of the names
+        :return: names and their dates as datetime64[ns], sorted by date
+        """
+        mtime = os.stat(path).st_mtime
+        cache_file = self._entry_path(entry)
+        names = np.array([], dtype=str)
+        dates = np.array([], dtype='datetime64[ns]')
+        ignored = np.array([], dtype=str)
+        if os.path.isfile(cache_file):
+            try:
+                with np.load(cache_file) as cached:
+                    names = cached['names']
+                    dates = cached['dates']
+                    ignored = cached['ignored']
+                    if (cached['mtime'] == mtime and
+                            cached['scanned'] - mtime > _MTIME_SLACK):
+                        return names, dates
+            except (OSError, KeyError, ValueError):
+                self.logger.warning(f'Discarding broken index {cache_file}')
+                names = np.array([], dtype=str)
+                dates = np.array([], dtype='datetime64[ns]')
+                ignored = np.array([], dtype=str)
+
+        scanned = time.time()
+        listing = np.array(os.listdir(path), dtype=str)
+        # Keep what is still there, parse only what is new. Names that did
+        # not parse are remembered so they are only reported once.
+        keep = np.isin(names, listing)
+        unseen = np.setdiff1d(listing, np.concatenate([names, ignored]))
+        new_names, new_dates = parse_names(unseen, name_format, f'in {path} ')
+        ignored = np.concatenate([ignored[np.isin(ignored, listing)],
+                                  np.setdiff1d(unseen, new_names)])
+        names = np.concatenate([names[keep], new_names])
+        dates = np.concatenate([dates[keep], new_dates])
+        order = np.argsort(dates, kind='stable')
+        names = names[order]
+        dates = dates[order]
+
+        # Several day workers may refresh the same entry at once
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, names=names, dates=dates, ignored=ignored,
+                     mtime=mtime, scanned=scanned)
+        os.replace(tmp_file, cache_file)
+        return names, dates
+
+    def folders(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Day folders of the source directory
+
+        :return: folder names and their dates as datetime64[ns], sorted by
+            date
+        """
+        return self._lookup(self.source, 'folders', self.folder_format)
+
+    def image_times(self, day_dir: str) -> np.ndarray:
+        """
+        Dates of every image in a day folder
+
+        :param day_dir: name of the day folder
+        :return: sorted image dates as datetime64[ns]
+        """
+        _, dates = self._lookup(os.path.join(self.source, day_dir),
+                                'day_' + day_dir.replace(os.sep, '_'),
+                                self.image_name_format)
+        return dates
@@ -2,12 +2,15 @@ import logging
 import os
 import time
 from datetime import datetime, timedelta
-from typing import List, Iterator
+from typing import List, Tuple
 
-import MySQLdb
 import numpy as np
 import pandas as pd
 
+from pv_timelapse.image_index import ImageIndex
+from pv_timelapse.irradiance import IrradianceSource
+from pv_timelapse.name_parsing import parse_names
+
 
 class Params:
     """Container class for various relevant parameters"""
@@ -18,7 +21,15 @@ class Params:
                  linear_time: bool, input_dict: dict, output_dict: dict,
                  sql_user: str, sql_passwd: str, sql_host: str, sql_port: int,
                  sql_db: str, sql_table: str, table_column: str, time_col: str,
-                 defer_img_indexing: bool = False):
+                 defer_img_indexing: bool = False, resampling: str = 'auto',
+                 loader: str = 'auto', pipeline: bool = False,
+                 decode_threads: int = 2, queue_depth: int = 8,
+                 frame_workers: int = 1, cache_dir: os.path.abspath = None,
+                 cache_mb: float = 0, plot_renderer: str = 'matplotlib',
+                 segment_frames: int = 0, frame_selection: str = 'uniform',
+                 seg_resolution: int = 25, cloud_threshold: float = 0.6,
+                 report: bool = False, profiler: str = 'none',
+                 image_interval: float = 10):
         """
         Constructor for the container class
 
@@ -41,6 +52,34 @@ class Params:
         :param time_col: column of the table containing datetime information
         :param defer_img_indexing: delay getting names of image files until
             manually started later. Useful for slow network drives.
+        :param resampling: how to scale the images, see
+            resampling.scale_frame
+        :param loader: name of the image loader, see loading.load_frame
+        :param pipeline: decode, composite and encode frames concurrently
+        :param decode_threads: threads decoding images in pipeline mode
+        :param queue_depth: frames buffered between pipeline stages
+        :param frame_workers: processes rendering the frames of one video
+        :param cache_dir: directory for the persistent image index and the
+            local irradiance cache. None to list and parse the folders and
+            query the database on every run.
+        :param cache_mb: memory budget in MB for keeping decoded images that
+            are shown again later
+        :param plot_renderer: 'matplotlib' or 'numpy' for the lightweight
+            raster renderer
+        :param segment_frames: render the video in resumable segments of this
+            many frames, 0 to write it in one piece
+        :param frame_selection: 'uniform' to skip images evenly, 'ghi' or
+            'thumbnail' to spend more frames where the sky changes faster
+        :param seg_resolution: percentage of the image resolution the cloud
+            segmentation works at
+        :param cloud_threshold: red/blue ratio above which a sky pixel counts
+            as cloud
+        :param report: write the timing report of each video next to it,
+            with '.stats.json' appended
+        :param profiler: 'cprofile' to profile each video into a file next
+            to it with '.prof' appended, 'none' otherwise
+        :param image_interval: seconds between the images of the camera,
+            to estimate the number of images without listing them
         """
         self.source = source_path
         self.write = None
@@ -54,9 +93,16 @@ class Params:
         self.linear_time = linear_time
         self.input_dict = input_dict
         self.output_dict = output_dict
-        self.dir_folders = os.listdir(self.source)
+        if cache_dir:
+            self.index = ImageIndex(source_path, folder_format,
+                                    image_name_format, cache_dir)
+            self.dir_folders = None
+        else:
+            self.index = None
+            self.dir_folders = os.listdir(self.source)
         self.day_folders = None
         self.image_times = []
+        self.ghi_times = None
         self.ghi_data = None
         self.sql_user = sql_user
         self.sql_passwd = sql_passwd
@@ -66,25 +112,50 @@ class Params:
         self.sql_table = sql_table
         self.table_column = table_column
         self.time_col = time_col
+        self.irradiance = IrradianceSource.mysql(
+            sql_host, sql_port, sql_user, sql_passwd, sql_db, sql_table,
+            table_column, time_col, cache_dir=cache_dir)
         self.show_pbar = True
         self.defer_img_indexing = defer_img_indexing
+        self.resampling = resampling
+        self.loader = loader
+        self.pipeline = pipeline
+        self.decode_threads = decode_threads
+        self.queue_depth = queue_depth
+        self.frame_workers = frame_workers
+        self.cache_mb = cache_mb
+        self.plot_renderer = plot_renderer
+        self.segment_frames = segment_frames
+        self.frame_selection = frame_selection
+        self.seg_resolution = seg_resolution
+        self.cloud_threshold = cloud_threshold
+        self.report = report
+        self.profiler = profiler
+        self.image_interval = image_interval
+        # Further videos rendered in the same pass, see outputs.OutputSpec
+        self.outputs = []
 
     def set_dates(self, start_date: datetime, end_date: datetime,
                   write_path: os.path.abspath,
-                  seg_path: os.path.abspath = None):
+                  seg_path: os.path.abspath = None,
+                  ghi: Tuple[np.ndarray, np.ndarray] = None):
         """
         Sets the start and end dates and retrieves irradiance data
 
         :param start_date: when to start the timelapse
         :param end_date: when to end the timelapse
         :param write_path: path to the output video
-        :param seg_path: path to output CSV for segmentation
+        :param seg_path: path to the segmentation output, see
+            segmentation.write_segmentation
+        :param ghi: timestamps and irradiance values between the dates if
+            they were already fetched, e.g. with IrradianceSource.fetch_many
         """
         self.start_date = start_date
         self.end_date = end_date
         self.write = write_path
         self.seg_write = seg_path
-        self.ghi_data = self.get_ghi()
+        self.ghi_times, self.ghi_data = self.get_ghi() if ghi is None \
+            else ghi
         self.image_times = []
         if not self.defer_img_indexing:
             self.image_indexing()
@@ -98,55 +169,46 @@ class Params:
         """
         self.show_pbar = show_pbar
 
-    def find_folders(self) -> Iterator[str]:
+    def find_folders(self) -> List[str]:
         """
         Finds the folders encompassing the given dates.
 
         :return: Name of the directory
         """
-        days = []
-
-        for folder_name in self.dir_folders:
-            try:
-                days += [datetime.strptime(folder_name, self.folder_format)]
-            except:
-                continue
-        days.sort()
         start_day = datetime(self.start_date.year, self.start_date.month,
                              self.start_date.day)
+        if self.index is not None:
+            names, dates = self.index.folders()
+        else:
+            names, dates = parse_names(self.dir_folders, self.folder_format,
+                                       f'in {self.source} ')
+        in_range = (dates >= np.datetime64(start_day)) & \
+                   (dates <= np.datetime64(self.end_date))
+        return names[in_range].tolist()
 
-        day_folders = [str(x)[0:10] for x in
-                       [y for y in days if start_day <= y <= self.end_date]]
-        return day_folders
-
-    def get_image_times(self, day_dir: str) -> List[datetime]:
+    def get_image_times(self, day_dir: str) -> np.ndarray:
         """
-        Returns a list of the dates of every picture in a folder.
+        Returns the dates of every picture in a folder.
 
         :param day_dir: Folder containing the image files
-        :return: List of datetimes of the images
+        :return: sorted datetime64 array of the image dates
         """
-        day_path = os.path.join(self.source, day_dir)
-
-        file_dates = []
-        for pic_name in os.listdir(day_path):
-            try:
-                file_dates += [
-                    datetime.strptime(pic_name, self.image_name_format)]
-            except:
-                continue
-        file_dates.sort()
-        file_dates = [x for x in file_dates if
-                      self.start_date <= x <= self.end_date]
-
-        return file_dates
+        if self.index is not None:
+            dates = self.index.image_times(day_dir)
+        else:
+            day_path = os.path.join(self.source, day_dir)
+            _, dates = parse_names(os.listdir(day_path),
+                                   self.image_name_format, f'in {day_path} ')
+        return dates[(dates >= np.datetime64(self.start_date)) &
+                     (dates <= np.datetime64(self.end_date))]
 
     def image_indexing(self):
         """Get image names if previously deferred"""
         self.day_folders = self.find_folders()
+        times = [np.array([], dtype='datetime64[ns]')]
         for folder in self.day_folders:
-            self.image_times += self.get_image_times(folder)
-        self.image_times = pd.DatetimeIndex(self.image_times)
+            times += [self.get_image_times(folder)]
+        self.image_times = pd.DatetimeIndex(np.concatenate(times))
 
     def date_to_path(self, img_date: datetime) -> os.path.abspath:
         """
@@ -158,23 +220,13 @@ class Params:
         image_name = img_date.strftime(self.image_name_format)
         return os.path.join(self.source, folder_name, image_name)
 
-    def get_ghi(self) -> np.ndarray:
+    def get_ghi(self) -> Tuple[np.ndarray, np.ndarray]:
         """
         Gets global horizontal irradiance values between the input dates
 
-        :return: array of irradiance values every second
+        :return: timestamps as datetime64[ns] and the irradiance values
         """
-        db = MySQLdb.connect(host=self.sql_host, port=self.sql_port,
-                             user=self.sql_user, passwd=self.sql_passwd,
-                             db=self.sql_db)
-        c = db.cursor()
-        c.execute('SELECT {} FROM {} '
-                  'WHERE {} BETWEEN \'{}\' and \'{}\''
-                  .format(self.table_column, self.sql_table, self.time_col,
-                          self.start_date.strftime('%Y-%m-%d %H-%M-%S'),
-                          self.end_date.strftime('%Y-%m-%d %H-%M-%S')))
-        out = c.fetchall()
-        return np.array([float(n[0]) for n in out])
+        return self.irradiance.fetch(self.start_date, self.end_date)
 
 
 class ProgressBar:
@@ -204,8 +256,12 @@ class ProgressBar:
         if progress >= 1:
             progress = 1
         block = int(round(self.bar_length * progress))
-        eta_seconds = (elapsed / progress) * (1 - progress)
-        eta = timedelta(seconds=eta_seconds)
+        if progress > 0:
+            eta_seconds = (elapsed / progress) * (1 - progress)
+            eta = timedelta(seconds=eta_seconds)
+        else:
+            # Nothing done yet to extrapolate from
+            eta = '-:--:--'
         print("\rProgress: [{}] {:4.2f}% ETA: {:.7}"
               .format("#" * block + "-" * (self.bar_length - block),
                       progress * 100, str(eta)), end='', flush=True)
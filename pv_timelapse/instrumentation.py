@@ -0,0 +1,138 @@
+"""Per-stage timing, counters and queue depths of the rendering"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Stats:
+    """
+    Accumulates the wall time and calls of each stage, counters such as the
+    bytes read, and sampled gauges such as queue depths. Safe to use from
+    several threads. Stages running in different threads overlap, so their
+    times may add up to more than the wall time of the job.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def reset(self):
+        """Forgets everything recorded so far"""
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def record(self, name: str, seconds: float, calls: int = 1):
+        """
+        Adds time spent in a stage
+
+        :param name: name of the stage
+        :param seconds: wall time spent
+        :param calls: number of calls the time covers
+        """
+        with self._lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += calls
+            stage[1] += seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times the enclosed block as one call of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def count(self, name: str, amount: float = 1):
+        """Adds to a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def sample(self, name: str, value: float):
+        """Records one observation of a gauge, e.g. the length of a queue"""
+        with self._lock:
+            gauge = self.gauges.setdefault(name, [0, 0.0, value])
+            gauge[0] += 1
+            gauge[1] += value
+            gauge[2] = max(gauge[2], value)
+
+    def to_dict(self) -> dict:
+        """
+        :return: JSON-compatible summary that merge accepts
+        """
+        with self._lock:
+            return {
+                'stages': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self.stages.items()},
+                'counters': dict(self.counters),
+                'gauges': {name: {'samples': samples, 'total': total,
+                                  'mean': total / samples, 'max': peak}
+                           for name, (samples, total, peak)
+                           in self.gauges.items()}}
+
+    def merge(self, summary: dict):
+        """
+        Adds a summary recorded elsewhere, e.g. in a worker process
+
+        :param summary: result of to_dict
+        """
+        with self._lock:
+            for name, stage in summary.get('stages', {}).items():
+                own = self.stages.setdefault(name, [0, 0.0])
+                own[0] += stage['calls']
+                own[1] += stage['seconds']
+            for name, amount in summary.get('counters', {}).items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            for name, gauge in summary.get('gauges', {}).items():
+                own = self.gauges.setdefault(name, [0, 0.0, gauge['max']])
+                own[0] += gauge['samples']
+                own[1] += gauge['total']
+                own[2] = max(own[2], gauge['max'])
+
+
+# Statistics of this process, reset at the start of every job
+stats = Stats()
+
+
+def job_report(p, seconds: float) -> dict:
+    """
+    Report of the job that just ran in this process
+
+    :param p: parameter container of the job
+    :param seconds: wall time of the job
+    :return: JSON-compatible report
+    """
+    report = {'write': p.write, 'start_date': str(p.start_date),
+              'end_date': str(p.end_date), 'images': len(p.image_times),
+              'seconds': seconds}
+    report.update(stats.to_dict())
+    frames = report['counters'].get('frames', 0)
+    report['frames per second'] = frames / seconds if seconds > 0 else 0
+    return report
+
+
+def combine_reports(reports: list) -> dict:
+    """
+    Sums the reports of several jobs, e.g. from different pool workers
+
+    :param reports: results of job_report
+    :return: report with every job and their totals
+    """
+    total = Stats()
+    for report in reports:
+        total.merge(report)
+    return {'jobs': reports, 'total': total.to_dict()}
+
+
+def write_report(report: dict, path: os.path.abspath):
+    """Writes a report as indented JSON"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, path)
@@ -0,0 +1,399 @@
+"""Irradiance data access with pooled connections and a local day cache"""
+import hashlib
+import logging
+import os
+import queue
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pv_timelapse.lod import minmax_envelope
+
+_IDENTIFIER = re.compile(r'\A\w+\Z')
+
+
+def _mysql_connect(**kwargs):
+    """Opens a MySQL connection streaming results with an unbuffered cursor"""
+    import MySQLdb
+    import MySQLdb.cursors
+    return MySQLdb.connect(cursorclass=MySQLdb.cursors.SSCursor, **kwargs)
+
+
+class IrradianceSource:
+    """
+    Reads a time and a value column from a database table.
+
+    Connections are pooled per process, queries are parameterized and rows
+    are streamed from the cursor into preallocated arrays. With a cache
+    directory, every complete day fetched is stored locally, so it is never
+    queried again.
+    """
+    logger = logging.getLogger('Irradiance')
+
+    def __init__(self, connect: Callable, table: str, column: str,
+                 time_col: str, paramstyle: str = 'format',
+                 quote: str = '`',
+                 cache_dir: os.path.abspath = None, cache_key: str = '',
+                 pool_size: int = 2, batch_size: int = 4096,
+                 rows_per_second: float = 1.0):
+        """
+        :param connect: picklable function returning a new DB-API connection
+        :param table: name of the table to pull from
+        :param column: column holding the irradiance values
+        :param time_col: column holding the timestamps
+        :param paramstyle: DB-API parameter style, 'format' or 'qmark'
+        :param quote: character used to quote identifiers
+        :param cache_dir: directory for the local day cache, None to disable
+        :param cache_key: identifies the database in the cache directory
+        :param pool_size: number of idle connections kept open
+        :param batch_size: rows fetched from the cursor at a time
+        :param rows_per_second: expected data rate, used to size the arrays
+        """
+        for name in [table, column, time_col]:
+            if not _IDENTIFIER.match(name):
+                raise ValueError(f'Invalid SQL identifier: {name}')
+        self.connect = connect
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+        marker = '%s' if paramstyle == 'format' else '?'
+        self.sql = (f'SELECT {quote}{time_col}{quote}, '
+                    f'{quote}{column}{quote} FROM {quote}{table}{quote} '
+                    f'WHERE {quote}{time_col}{quote} >= {marker} AND '
+                    f'{quote}{time_col}{quote} < {marker} '
+                    f'ORDER BY {quote}{time_col}{quote}')
+        self.cache_dir = None
+        if cache_dir:
+            key = hashlib.sha1('\n'.join([cache_key, table, column, time_col])
+                               .encode()).hexdigest()[:16]
+            self.cache_dir = os.path.join(cache_dir, 'irradiance_' + key)
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self._pool = queue.LifoQueue()
+
+    @classmethod
+    def mysql(cls, host: str, port: int, user: str, passwd: str, db: str,
+              table: str, column: str, time_col: str,
+              **kwargs) -> 'IrradianceSource':
+        """
+        Source reading from a MySQL server with an unbuffered cursor
+
+        :param host: host containing the database
+        :param port: port for the host
+        :param user: username for accessing the irradiance database
+        :param passwd: password for the SQL user
+        :param db: name of the database
+        :param table: name of the table to pull from
+        :param column: column holding the irradiance values
+        :param time_col: column holding the timestamps
+        :param kwargs: further IrradianceSource options
+        :return: the source
+        """
+        connect = partial(_mysql_connect, host=host, port=port, user=user,
+                          passwd=passwd, db=db)
+        return cls(connect, table, column, time_col, paramstyle='format',
+                   quote='`', cache_key=f'mysql://{host}:{port}/{db}',
+                   **kwargs)
+
+    @classmethod
+    def sqlite(cls, path: os.path.abspath, table: str, column: str,
+               time_col: str, **kwargs) -> 'IrradianceSource':
+        """
+        Source reading from a local SQLite file, e.g. as a stand-in for the
+        irradiance server
+
+        :param path: path of the database file
+        :param table: name of the table to pull from
+        :param column: column holding the irradiance values
+        :param time_col: column holding the timestamps, as ISO strings
+        :param kwargs: further IrradianceSource options
+        :return: the source
+        """
+        connect = partial(sqlite3.connect, path, check_same_thread=False)
+        return cls(connect, table, column, time_col, paramstyle='qmark',
+                   quote='"', cache_key=f'sqlite://{os.path.abspath(path)}',
+                   **kwargs)
+
+    def __getstate__(self) -> dict:
+        # Open connections stay with the process that opened them
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._pool = queue.LifoQueue()
+
+    @contextmanager
+    def _connection(self):
+        """Borrows a pooled connection, dropping it if anything fails"""
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = self.connect()
+        try:
+            yield connection
+        except BaseException:
+            connection.close()
+            raise
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        """Closes all idle connections"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def query(self, start: datetime,
+              stop: datetime) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Fetches the rows with start <= time < stop from the database
+
+        :param start: first time to include
+        :param stop: first time to exclude
+        :return: timestamps as datetime64[ns] and values as float32
+        """
+        expected = max(int((stop - start).total_seconds() *
+                           self.rows_per_second) + 1, self.batch_size)
+        times = np.empty(expected, dtype='datetime64[ns]')
+        values = np.empty(expected, dtype=np.float32)
+        count = 0
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(self.sql,
+                               (start.strftime('%Y-%m-%d %H:%M:%S'),
+                                stop.strftime('%Y-%m-%d %H:%M:%S')))
+                while True:
+                    rows = cursor.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    end = count + len(rows)
+                    if end > len(values):
+                        size = max(2 * len(values), end)
+                        times = np.resize(times, size)
+                        values = np.resize(values, size)
+                    row_times, row_values = zip(*rows)
+                    times[count:end] = np.array(row_times,
+                                                dtype='datetime64[ns]')
+                    # NULL values become NaN
+                    values[count:end] = np.array(row_values,
+                                                 dtype=np.float32)
+                    count = end
+            finally:
+                cursor.close()
+        return times[:count], values[:count]
+
+    def _day_file(self, day: pd.Timestamp) -> os.path.abspath:
+        return os.path.join(self.cache_dir, day.strftime('%Y-%m-%d.npz'))
+
+    def _load_day(self, day: pd.Timestamp) -> Tuple[np.ndarray, np.ndarray]:
+        """The cached rows of a day, None if the day is not cached"""
+        path = self._day_file(day)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as cached:
+                return cached['times'], cached['values']
+        except (OSError, KeyError, ValueError):
+            self.logger.warning(f'Discarding broken irradiance cache {path}')
+            return None
+
+    def _store_day(self, day: pd.Timestamp, times: np.ndarray,
+                   values: np.ndarray):
+        path = self._day_file(day)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, times=times, values=values)
+        os.replace(tmp_path, path)
+
+    def fetch(self, start: datetime,
+              end: datetime) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Irradiance between two dates, both included. Complete days come from
+        the local cache when possible; missing ones are queried whole, in one
+        query per run of consecutive days, and cached.
+
+        :param start: first time to include
+        :param end: last time to include
+        :return: timestamps as datetime64[ns] and values as float32
+        """
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end)
+        if self.cache_dir is None:
+            times, values = self.query(start, end + timedelta(seconds=1))
+        else:
+            # A day can only be cached once it is over
+            complete = pd.Timestamp(datetime.now()).normalize()
+            parts = []
+            missing = []
+            for day in pd.date_range(start.normalize(), end.normalize()):
+                if day >= complete:
+                    # The rest of the range is still being logged
+                    parts += self._fetch_missing(missing)
+                    missing = []
+                    parts += [self.query(max(day, start),
+                                         end + timedelta(seconds=1))]
+                    break
+                cached = self._load_day(day)
+                if cached is None:
+                    missing += [day]
+                    continue
+                parts += self._fetch_missing(missing)
+                missing = []
+                parts += [cached]
+            parts += self._fetch_missing(missing)
+            times = np.concatenate([np.array([], dtype='datetime64[ns]')] +
+                                   [t for t, _ in parts])
+            values = np.concatenate([np.array([], dtype=np.float32)] +
+                                    [v for _, v in parts])
+        first = np.searchsorted(times, start.to_datetime64(), side='left')
+        last = np.searchsorted(times, end.to_datetime64(), side='right')
+        return times[first:last], values[first:last]
+
+    def _fetch_missing(self, days: list) -> list:
+        """
+        Queries a run of consecutive uncached days at once and caches them
+
+        :return: (times, values) of every day
+        """
+        if not days:
+            return []
+        times, values = self.query(days[0], days[-1] + timedelta(days=1))
+        bounds = np.searchsorted(times, np.array(
+            days + [days[-1] + timedelta(days=1)], dtype='datetime64[ns]'))
+        parts = []
+        for day, lo, hi in zip(days, bounds[:-1], bounds[1:]):
+            self._store_day(day, times[lo:hi], values[lo:hi])
+            parts += [(times[lo:hi], values[lo:hi])]
+        return parts
+
+    def fetch_many(self, ranges: List[Tuple[datetime, datetime]],
+                   max_gap: timedelta = timedelta(days=1)) -> \
+            List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Irradiance for several date ranges at once. Ranges closer than
+        max_gap are merged and fetched together, so a run of consecutive days
+        costs one query; the result is split with views into the merged
+        arrays, without copying.
+
+        :param ranges: (start, end) of every range, both included
+        :param max_gap: largest gap between ranges that is fetched along
+        :return: (times, values) for every range, in the order given
+        """
+        bounds = [(pd.Timestamp(start), pd.Timestamp(end))
+                  for start, end in ranges]
+        out = [None] * len(bounds)
+        groups = []
+        for i in sorted(range(len(bounds)), key=lambda i: bounds[i][0]):
+            start, end = bounds[i]
+            if groups and start - groups[-1][1] <= max_gap:
+                groups[-1][1] = max(groups[-1][1], end)
+                groups[-1][2] += [i]
+            else:
+                groups += [[start, end, [i]]]
+        for start, end, members in groups:
+            times, values = self.fetch(start, end)
+            first = np.searchsorted(
+                times, [bounds[i][0].to_datetime64() for i in members])
+            last = np.searchsorted(
+                times, [bounds[i][1].to_datetime64() for i in members],
+                side='right')
+            for i, lo, hi in zip(members, first, last):
+                out[i] = (times[lo:hi], values[lo:hi])
+        return out
+
+
+class IrradianceSeries:
+    """
+    Timestamped irradiance values. Nothing assumes a fixed data rate, so
+    skipped or doubled rows neither shift the values nor run past the end.
+    """
+
+    def __init__(self, times: np.ndarray, values: np.ndarray):
+        """
+        :param times: sorted timestamps as datetime64[ns]
+        :param values: value at every timestamp
+        """
+        self.times = np.asarray(times, dtype='datetime64[ns]')
+        self.values = np.asarray(values, dtype=np.float32)
+        # Arrays owned by the series that append can fill in place
+        self._storage = None
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def append(self, times: np.ndarray, values: np.ndarray) -> int:
+        """
+        Adds rows logged after the last one. The storage grows
+        geometrically, so appending costs O(new rows) on average. times and
+        values become new views, the old arrays stay valid.
+
+        :param times: sorted timestamps as datetime64[ns]
+        :param values: value at every timestamp
+        :return: number of rows added, rows not newer than the series are
+            skipped
+        """
+        times = np.asarray(times, dtype='datetime64[ns]')
+        values = np.asarray(values, dtype=np.float32)
+        if len(self):
+            newer = times > self.times[-1]
+            times = times[newer]
+            values = values[newer]
+        count = len(self)
+        end = count + len(times)
+        if self._storage is None or end > len(self._storage[0]):
+            capacity = max(2 * count, end, 1024)
+            stored_times = np.empty(capacity, dtype='datetime64[ns]')
+            stored_values = np.empty(capacity, dtype=np.float32)
+            stored_times[:count] = self.times
+            stored_values[:count] = self.values
+            self._storage = (stored_times, stored_values)
+        stored_times, stored_values = self._storage
+        stored_times[count:end] = times
+        stored_values[count:end] = values
+        self.times = stored_times[:end]
+        self.values = stored_values[:end]
+        return len(times)
+
+    def value_at(self, date: datetime) -> float:
+        """
+        The last value logged at or before a date, in O(log n)
+
+        :param date: date to look up
+        :return: the value, the first one for dates before the series and
+            NaN if the series is empty
+        """
+        if len(self) == 0:
+            return float('nan')
+        index = np.searchsorted(self.times, pd.Timestamp(date).to_datetime64(),
+                                side='right') - 1
+        return float(self.values[max(index, 0)])
+
+    def envelope(self, start: datetime, end: datetime,
+                 bins: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Minimum and maximum of evenly spaced bins, e.g. one per pixel column
+        of a plot
+
+        :param start: start of the first bin
+        :param end: end of the last bin
+        :param bins: number of bins
+        :return: bin centres in seconds since start and the minimum and
+            maximum of every bin, NaN for bins without data
+        """
+        start = pd.Timestamp(start).to_datetime64()
+        span = (pd.Timestamp(end).to_datetime64() - start) / \
+            np.timedelta64(1, 's')
+        seconds = (self.times - start) / np.timedelta64(1, 's')
+        return minmax_envelope(seconds, self.values, 0.0, span, bins)
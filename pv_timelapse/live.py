@@ -0,0 +1,204 @@
+"""Follows the current day folder and extends a live timelapse"""
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta, tzinfo
+
+import numpy as np
+import pandas as pd
+
+from pv_timelapse.frame_cache import FrameCache
+from pv_timelapse.frame_plan import FramePlan
+from pv_timelapse.frame_tools import reset_frame_shape
+from pv_timelapse.indexing import Params
+from pv_timelapse.irradiance import IrradianceSeries
+from pv_timelapse.name_parsing import parse_names
+from pv_timelapse.rendering import render_frames
+from pv_timelapse.segments import concat_segments
+from pv_timelapse.video_writer import PipeWriter
+
+
+class LiveTimelapse:
+    """
+    Renders a day while its images arrive. Each update only parses the names
+    the day folder did not hold before, queries the irradiance logged since the last
+    update and encodes the new frames into one more HLS segment. Every
+    segment's timestamps continue where the previous one ended, so players
+    see one stream. The playlist, and with a window a rolling video joined
+    from the segments in it, are rewritten after every update.
+    """
+    logger = logging.getLogger('Live')
+
+    def __init__(self, p: Params, frame_step: int = 1, window: int = 0,
+                 settle: float = 5.0, tz: tzinfo = None):
+        """
+        :param p: parameter container with the dates of the day set. The
+            segments and the playlist go into a folder named after p.write
+            with '.live' appended, p.write receives the rolling video.
+        :param frame_step: use every n-th image as a frame
+        :param window: number of segments kept in the playlist and the rolling
+            video, 0 to keep the whole day in the playlist without a rolling
+            video, as rejoining a growing day would cost more on every
+            update
+        :param settle: seconds an image must be old before it is read, so
+            files still being written are skipped
+        :param tz: time zone of the site, which the dates of the day are in.
+            None for the time zone of this machine.
+        """
+        self.p = p
+        reset_frame_shape()
+        self.frame_step = frame_step
+        self.window = window
+        self.settle = settle
+        self.tz = tz
+        self.directory = p.write + '.live'
+        os.makedirs(self.directory, exist_ok=True)
+        self.day_dir = p.start_date.strftime(p.folder_format)
+        self.seen = set()
+        self.image_times = np.array([], dtype='datetime64[ns]')
+        self.next_image = 0
+        self.series = IrradianceSeries(np.array([], dtype='datetime64[ns]'),
+                                       np.array([], dtype=np.float32))
+        self.segments = []
+        self.sequence = 0
+        self.elapsed = 0.0
+        self.cache = FrameCache(p.cache_mb)
+        self.frame_rate = float(p.input_dict.get('-r', 30))
+
+    def now(self) -> datetime:
+        """Current time at the site, naive like the dates of the day"""
+        if self.tz is None:
+            return datetime.now()
+        return datetime.now(self.tz).replace(tzinfo=None)
+
+    def poll_images(self, now: datetime) -> int:
+        """
+        Picks up the images added to the day folder. Only names not seen
+        before are parsed.
+
+        :param now: current time at the site
+        :return: number of new images
+        """
+        path = os.path.join(self.p.source, self.day_dir)
+        if not os.path.isdir(path):
+            return 0
+        listing = np.array([name for name in os.listdir(path)
+                            if name not in self.seen], dtype=str)
+        names, dates = parse_names(listing, self.p.image_name_format,
+                                   f'in {path} ')
+        last = np.datetime64(min(pd.Timestamp(self.p.end_date),
+                                 pd.Timestamp(now) -
+                                 timedelta(seconds=self.settle)))
+        # Images too fresh to read are parsed again on the next poll
+        settled = dates <= last
+        self.seen.update(np.setdiff1d(listing, names[~settled]))
+        dates = dates[settled & (dates >= np.datetime64(self.p.start_date))]
+        # Only images after the last known one are new
+        if len(self.image_times):
+            dates = dates[dates > self.image_times[-1]]
+        self.image_times = np.concatenate([self.image_times, dates])
+        return len(dates)
+
+    def poll_ghi(self, now: datetime) -> int:
+        """
+        Queries the irradiance logged since the last update
+
+        :param now: current time at the site
+        :return: number of new rows
+        """
+        if len(self.series):
+            start = pd.Timestamp(self.series.times[-1]).to_pydatetime()
+        else:
+            start = self.p.start_date
+        stop = min(pd.Timestamp(now), pd.Timestamp(self.p.end_date))
+        times, values = self.p.irradiance.query(
+            start, stop.to_pydatetime() + timedelta(seconds=1))
+        return self.series.append(times, values)
+
+    def _write_playlist(self, finished: bool):
+        """Rewrites the HLS playlist of the segments in the window"""
+        segments = self.segments[-self.window:] if self.window else \
+            self.segments
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3',
+                 '#EXT-X-TARGETDURATION:' + str(max(
+                     [math.ceil(d) for _, _, d in segments] or [1])),
+                 f'#EXT-X-MEDIA-SEQUENCE:{segments[0][0] if segments else 0}']
+        if not self.window:
+            lines += ['#EXT-X-PLAYLIST-TYPE:EVENT']
+        for _, name, duration in segments:
+            lines += [f'#EXTINF:{duration:.3f},', name]
+        if finished:
+            lines += ['#EXT-X-ENDLIST']
+        path = os.path.join(self.directory, 'live.m3u8')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def update(self, now: datetime = None, finished: bool = False) -> int:
+        """
+        Renders the frames for the images that arrived since the last update
+
+        :param now: current time at the site, defaults to the clock
+        :param finished: whether this is the last update of the day
+        :return: number of frames added
+        """
+        now = now or self.now()
+        new_images = self.poll_images(now)
+        new_rows = self.poll_ghi(now)
+        frames = np.arange(self.next_image, len(self.image_times),
+                           self.frame_step)
+        self.logger.info(f'{new_images} new images, {new_rows} new '
+                         f'irradiance rows, {len(frames)} new frames')
+        if len(frames):
+            self.next_image = int(frames[-1]) + self.frame_step
+            p = self.p
+            p.image_times = pd.DatetimeIndex(self.image_times)
+            # New array objects, so the plot is redrawn with the new data
+            p.ghi_times = self.series.times
+            p.ghi_data = self.series.values
+            name = f'{self.sequence:05d}.ts'
+            path = os.path.join(self.directory, name)
+            tmp_path = os.path.join(self.directory, 'next.tmp.ts')
+            # Each segment has its own ffmpeg process, whose timestamps would
+            # start from zero again
+            output_dict = dict(p.output_dict)
+            output_dict['-output_ts_offset'] = f'{self.elapsed:.6f}'
+            writer = PipeWriter(tmp_path, p.input_dict, output_dict)
+            try:
+                render_frames(p, FramePlan(p.image_times, frames), writer,
+                              cache=self.cache)
+            finally:
+                writer.close()
+            os.replace(tmp_path, path)
+            duration = len(frames) / self.frame_rate
+            self.segments += [(self.sequence, name, duration)]
+            self.sequence += 1
+            self.elapsed += duration
+            if self.window and len(self.segments) > 2 * self.window:
+                # Players may still be reading the segments just dropped
+                for _, old, _ in self.segments[:-2 * self.window]:
+                    os.remove(os.path.join(self.directory, old))
+                self.segments = self.segments[-2 * self.window:]
+        if len(frames) or finished:
+            self._write_playlist(finished)
+            if self.window and self.segments:
+                concat_segments([os.path.join(self.directory, name)
+                                 for _, name, _ in
+                                 self.segments[-self.window:]], self.p.write)
+        return len(frames)
+
+    def run(self, interval: float = 300):
+        """
+        Updates every interval seconds until the end date has passed
+
+        :param interval: seconds between updates
+        """
+        while True:
+            now = self.now()
+            finished = now >= self.p.end_date + timedelta(seconds=self.settle)
+            self.update(now, finished)
+            if finished:
+                return
+            time.sleep(interval)
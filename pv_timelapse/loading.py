@@ -0,0 +1,113 @@
+"""Image loading with reduced size JPEG decoding"""
+import io
+import os
+from typing import Callable, Union
+
+import numpy as np
+from skimage import img_as_ubyte
+from skimage.io import imread
+
+from pv_timelapse.instrumentation import stats
+from pv_timelapse.resampling import resize_frame, scale_frame, scaled_shape
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_loaders = {}
+
+
+def register_loader(name: str, loader: Callable[..., np.ndarray]):
+    """
+    Makes an image loader available to load_frame
+
+    :param name: name to select the loader by
+    :param loader: function taking a file object holding the image, the
+        resolution and the resampling method and returning the scaled uint8
+        frame
+    """
+    _loaders[name] = loader
+
+
+def available_loaders() -> list:
+    """Names of the registered image loaders"""
+    return ['auto'] + list(_loaders)
+
+
+def load_frame(path: Union[os.path.abspath, str], resolution: int = 100,
+               loader: str = 'auto', resampling: str = 'auto') -> np.ndarray:
+    """
+    Reads an image scaled to a percentage of its size
+
+    :param path: path of the image, read in one go before decoding so the
+        time spent on the share and on decoding are measured apart
+    :param resolution: percentage to scale the image by
+    :param loader: name of a registered loader, 'auto' for the fastest
+        available one
+    :param resampling: resampling method for any scaling left after decoding,
+        see resampling.scale_frame
+    :return: the scaled uint8 frame
+    """
+    if loader == 'auto':
+        loader = 'pil' if 'pil' in _loaders else 'skimage'
+    try:
+        load = _loaders[loader]
+    except KeyError:
+        raise ValueError(f'Unknown image loader: {loader}')
+    with stats.stage('read'):
+        with open(path, 'rb') as f:
+            data = f.read()
+    stats.count('bytes read', len(data))
+    with stats.stage('decode'):
+        return load(io.BytesIO(data), resolution, resampling)
+
+
+def _load_skimage(path: Union[os.path.abspath, str], resolution: int,
+                  resampling: str) -> np.ndarray:
+    """Decodes the full image with skimage and scales it afterwards"""
+    return scale_frame(imread(path), resolution, resampling)
+
+
+def _load_pil(path: Union[os.path.abspath, str], resolution: int,
+              resampling: str) -> np.ndarray:
+    """
+    Lets the JPEG decoder scale by 1/2, 1/4 or 1/8 in the DCT domain, then
+    resizes whatever is left
+    """
+    with Image.open(path) as img:
+        full = (img.height, img.width)
+        target = scaled_shape(full, resolution)
+        if resolution < 100 and img.format == 'JPEG':
+            # Picks the smallest DCT scale that is still at least this large
+            img.draft('RGB', (target[1], target[0]))
+        frame = np.asarray(img.convert('RGB'))
+    if frame.shape[:2] == full and resolution != 100:
+        # No reduced decoding happened, take the regular scaling path
+        return scale_frame(frame, resolution, resampling)
+    return resize_frame(frame, target, resampling)
+
+
+def load_thumbnail(path: Union[os.path.abspath, str],
+                   size: int = 32) -> np.ndarray:
+    """
+    Reads a small grayscale version of an image for comparing images.
+    JPEGs are decoded at 1/8 size when Pillow is available.
+
+    :param path: path of the image
+    :param size: side length of the square thumbnail
+    :return: the size x size uint8 thumbnail
+    """
+    if Image is not None:
+        with Image.open(path) as img:
+            if img.format == 'JPEG':
+                img.draft('L', (size, size))
+            frame = np.asarray(img.convert('L'))
+    else:
+        frame = img_as_ubyte(imread(path, as_gray=True))
+    return resize_frame(frame, (size, size))
+
+
+register_loader('skimage', _load_skimage)
+if Image is not None:
+    register_loader('pil', _load_pil)
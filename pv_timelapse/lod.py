@@ -0,0 +1,60 @@
+"""Level of detail reduction of long series for plotting"""
+from typing import Tuple
+
+import numpy as np
+
+
+def minmax_envelope(x: np.ndarray, y: np.ndarray, lo: float, hi: float,
+                    bins: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reduces a series to the minimum and maximum of evenly spaced bins, e.g.
+    one per pixel column. Unlike averaging, short spikes stay visible.
+
+    :param x: sorted positions of the samples
+    :param y: value of every sample, NaN values are skipped
+    :param lo: start of the first bin
+    :param hi: end of the last bin
+    :param bins: number of bins
+    :return: bin centres and the minimum and maximum of every bin, NaN for
+        bins without samples
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y)
+    first = np.searchsorted(x, lo, side='left')
+    last = np.searchsorted(x, hi, side='right')
+    x = x[first:last]
+    y = y[first:last]
+    finite = np.isfinite(y)
+    x = x[finite]
+    y = y[finite]
+
+    lows = np.full(bins, np.nan)
+    highs = np.full(bins, np.nan)
+    width = (hi - lo) / bins if hi > lo else 1.0
+    if len(y):
+        index = ((x - lo) / width).astype(np.intp).clip(0, bins - 1)
+        # The samples are sorted, so every bin is one contiguous run
+        starts = np.flatnonzero(np.diff(index)) + 1
+        starts = np.concatenate([[0], starts])
+        lows[index[starts]] = np.minimum.reduceat(y, starts)
+        highs[index[starts]] = np.maximum.reduceat(y, starts)
+    centres = lo + (np.arange(bins) + 0.5) * width
+    return centres, lows, highs
+
+
+def envelope_path(centres: np.ndarray, lows: np.ndarray,
+                  highs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Turns an envelope into one polyline visiting the minimum and maximum of
+    every bin, which draws like the full series at the binned resolution
+
+    :param centres: bin centres
+    :param lows: minimum of every bin
+    :param highs: maximum of every bin
+    :return: x and y of the polyline, twice as long as the envelope
+    """
+    x = np.repeat(centres, 2)
+    y = np.empty(2 * len(lows))
+    y[0::2] = lows
+    y[1::2] = highs
+    return x, y
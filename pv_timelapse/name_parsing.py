@@ -0,0 +1,204 @@
+"""Vectorized parsing of dates out of file and folder names"""
+import functools
+import logging
+import re
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# strftime directive: (field, regex, width written by strftime)
+_DIRECTIVES = {'Y': ('year', r'\d{4}', 4), 'y': ('year', r'\d{2}', 2),
+               'm': ('month', r'\d{1,2}', 2), 'd': ('day', r'\d{1,2}', 2),
+               'H': ('hour', r'\d{1,2}', 2), 'M': ('minute', r'\d{1,2}', 2),
+               'S': ('second', r'\d{1,2}', 2), 'f': ('us', r'\d{1,6}', 6)}
+_DEFAULTS = {'year': 1900, 'month': 1, 'day': 1, 'hour': 0, 'minute': 0,
+             'second': 0, 'us': 0}
+_LIMITS = {'month': (1, 12), 'day': (1, 31), 'hour': (0, 23),
+           'minute': (0, 59), 'second': (0, 61)}
+_NAT = np.datetime64('NaT', 'ns')
+
+
+def _assemble(fields: dict, count: int) -> np.ndarray:
+    """
+    Builds dates from integer field arrays, NaT where a field is out of range
+
+    :param fields: arrays of years, months, days, ...; missing fields use
+        their defaults
+    :param count: number of dates
+    :return: the dates as datetime64[ns]
+    """
+    values = {f: np.broadcast_to(np.asarray(fields.get(f, d), np.int64),
+                                 (count,)) for f, d in _DEFAULTS.items()}
+    valid = np.ones(count, dtype=bool)
+    for field, (low, high) in _LIMITS.items():
+        valid &= (values[field] >= low) & (values[field] <= high)
+    months = ((values['year'] - 1970) * 12 + values['month'] - 1)
+    month_start = months.astype('datetime64[M]').astype('datetime64[D]')
+    days = month_start + (values['day'] - 1)
+    # Day 31 of a 30 day month rolls over into the next month
+    valid &= days.astype('datetime64[M]') == months.astype('datetime64[M]')
+    dates = (days.astype('datetime64[ns]') +
+             values['hour'] * np.timedelta64(3600, 's') +
+             values['minute'] * np.timedelta64(60, 's') +
+             values['second'] * np.timedelta64(1, 's') +
+             values['us'] * np.timedelta64(1, 'us'))
+    dates[~valid] = _NAT
+    return dates
+
+
+class NameParser:
+    """
+    Parses the dates out of names following one datetime format.
+
+    The format is compiled once into a fixed-offset template, which reads the
+    digits of whole listings at once as a character matrix, and a regular
+    expression for names strftime would not have written, such as unpadded
+    numbers. Formats with textual directives are handed to pandas.
+    """
+    logger = logging.getLogger('Indexing')
+
+    def __init__(self, name_format: str):
+        """
+        :param name_format: datetime format of the names
+        """
+        self.name_format = name_format
+        self.fields = []
+        self.two_digit_year = False
+        # (field, offset, width) of every directive and the literal text
+        self.template = []
+        self.literals = []
+        offset = 0
+        pattern = ''
+        for token in re.split(r'(%.)', name_format):
+            if not token:
+                continue
+            if token == '%%' or not token.startswith('%') or \
+                    len(token) != 2:
+                text = '%' if token == '%%' else token
+                pattern += re.escape(text)
+                self.literals += [(offset, text)]
+                offset += len(text)
+            elif token[1] in _DIRECTIVES:
+                field, regex, width = _DIRECTIVES[token[1]]
+                self.two_digit_year |= token == '%y'
+                if field in self.fields:
+                    pattern += f'(?P={field})'
+                else:
+                    pattern += f'(?P<{field}>{regex})'
+                    self.fields += [field]
+                self.template += [(field, offset, width)]
+                offset += width
+            else:
+                # Month names, weekdays and the like are left to pandas
+                self.fields = None
+                break
+        self.length = offset
+        if not self.fields:
+            self.fields = None
+        self.regex = re.compile(r'\A' + pattern + r'\Z') \
+            if self.fields is not None else None
+
+    def _parse_fixed(self, names: np.ndarray) -> np.ndarray:
+        """Reads names laid out exactly as strftime writes them"""
+        dates = np.full(len(names), _NAT)
+        fits = np.char.str_len(names) == self.length
+        if not fits.any() or self.length == 0:
+            return dates
+        codes = names[fits].astype(f'U{self.length}').view(np.uint32)
+        codes = codes.reshape(-1, self.length)
+        valid = np.ones(len(codes), dtype=bool)
+        for offset, text in self.literals:
+            expected = np.frombuffer(text.encode('utf-32-le'), np.uint32)
+            valid &= (codes[::, offset:offset + len(text)] == expected).all(
+                axis=1)
+        fields = {}
+        for field, offset, width in self.template:
+            digits = codes[::, offset:offset + width].astype(np.int64) - 48
+            valid &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+            value = digits @ (10 ** np.arange(width - 1, -1, -1))
+            if field in fields:
+                valid &= fields[field] == value
+            fields[field] = value
+        if self.two_digit_year and 'year' in fields:
+            fields['year'] = fields['year'] + np.where(fields['year'] < 69,
+                                                       2000, 1900)
+        parsed = _assemble(fields, len(codes))
+        parsed[~valid] = _NAT
+        dates[fits] = parsed
+        return dates
+
+    def _parse_flexible(self, names: np.ndarray) -> np.ndarray:
+        """Reads names with the regular expression or pandas"""
+        series = pd.Series(names, dtype=object)
+        if self.regex is None:
+            dates = pd.to_datetime(series, format=self.name_format,
+                                   errors='coerce')
+            return dates.to_numpy(dtype='datetime64[ns]')
+        columns = series.str.extract(self.regex.pattern).dropna()
+        dates = np.full(len(names), _NAT)
+        if len(columns):
+            fields = {field: np.array(columns[field], dtype=np.int64)
+                      for field in self.fields}
+            if self.two_digit_year:
+                fields['year'] += np.where(fields['year'] < 69, 2000, 1900)
+            if 'us' in fields:
+                fields['us'] *= 10 ** (6 - np.array(columns['us'].str.len()))
+            dates[columns.index.to_numpy()] = _assemble(fields, len(columns))
+        return dates
+
+    def parse(self, names: np.ndarray,
+              where: str = '') -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Parses a listing. Names not following the format are logged as one
+        summary instead of being dropped silently.
+
+        :param names: array of names
+        :param where: description of the listing for the log message
+        :return: matching names and their dates as datetime64[ns], sorted by
+            date
+        """
+        names = np.asarray(names, dtype=str)
+        if self.fields is not None:
+            dates = self._parse_fixed(names)
+        else:
+            dates = np.full(len(names), _NAT)
+        rest = np.isnat(dates)
+        if rest.any():
+            dates[rest] = self._parse_flexible(names[rest])
+
+        valid = ~np.isnat(dates)
+        if not valid.all():
+            bad = names[~valid]
+            self.logger.warning(
+                f'{len(bad)} names {where}do not match {self.name_format}, '
+                f'e.g. {", ".join(bad[:3])}')
+        dates = dates[valid]
+        names = names[valid]
+        order = np.argsort(dates, kind='stable')
+        return names[order], dates[order]
+
+
+@functools.lru_cache(maxsize=None)
+def get_parser(name_format: str) -> NameParser:
+    """
+    Returns the compiled parser for a datetime format
+
+    :param name_format: datetime format of the names
+    :return: the parser
+    """
+    return NameParser(name_format)
+
+
+def parse_names(names: np.ndarray, name_format: str,
+                where: str = '') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parses the dates out of file or folder names
+
+    :param names: array of names
+    :param name_format: datetime format of the names
+    :param where: description of the listing for the log message
+    :return: names that matched the format and their dates as datetime64[ns],
+        sorted by date
+    """
+    return get_parser(name_format).parse(names, where)
@@ -0,0 +1,159 @@
+"""Several videos from one pass over the images of a timelapse"""
+import itertools
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from datetime import datetime
+from typing import Callable, List
+
+import numpy as np
+
+from pv_timelapse.frame_cache import FrameCache
+from pv_timelapse.frame_plan import FramePlan
+from pv_timelapse.frame_tools import Compositor
+from pv_timelapse.indexing import Params
+from pv_timelapse.instrumentation import stats
+from pv_timelapse.plotting import plot_ghi, plot_mask
+from pv_timelapse.resampling import resize_frame, scaled_shape
+from pv_timelapse.video_writer import PipeWriter
+
+
+class OutputSpec:
+    """
+    A video rendered alongside the one a parameter container describes.
+    Settings left at None are taken from the container.
+    """
+
+    def __init__(self, write: str, resolution: int = None,
+                 duration: float = None, input_dict: dict = None,
+                 output_dict: dict = None, start_date: datetime = None,
+                 end_date: datetime = None):
+        """
+        :param write: path of the video
+        :param resolution: output resolution as percentage of input
+        :param duration: length of the video in seconds
+        :param input_dict: FFmpeg input parameters, see config.create_dict
+        :param output_dict: FFmpeg output parameters, see config.create_dict
+        :param start_date: start of the video, within the container's dates
+        :param end_date: end of the video, within the container's dates
+        """
+        self.write = write
+        self.resolution = resolution
+        self.duration = duration
+        self.input_dict = input_dict
+        self.output_dict = output_dict
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def params(self, p: Params) -> Params:
+        """
+        A copy of a parameter container with the settings of this output and
+        only the images between its dates
+
+        :param p: container with indexed images
+        :return: the container of this output
+        """
+        job = copy(p)
+        job.write = self.write
+        for name in ['resolution', 'duration', 'input_dict', 'output_dict',
+                     'start_date', 'end_date']:
+            if getattr(self, name) is not None:
+                setattr(job, name, getattr(self, name))
+        times = p.image_times
+        job.image_times = times[(times >= job.start_date) &
+                                (times <= job.end_date)]
+        job.outputs = []
+        return job
+
+
+def render_outputs(p: Params, outputs: List[OutputSpec],
+                   progress: Callable[[float], None] = None,
+                   cache: FrameCache = None):
+    """
+    Writes several videos while decoding every image they show only once.
+    Each output resolves its own frame plan against the shared images. The
+    images are decoded at the largest resolution any output needs, ahead of
+    use on p.decode_threads threads, and scaled down for the smaller ones.
+
+    :param p: parameter container with indexed images
+    :param outputs: the videos to write
+    :param progress: called with the fraction of frames written over all
+        outputs
+    :param cache: cache to load the images through
+    """
+    if cache is None:
+        cache = FrameCache(p.cache_mb)
+    jobs = []
+    for output in outputs:
+        job = output.params(p)
+        if len(job.image_times) == 0:
+            logging.warning(f'No images between {job.start_date} and '
+                            f'{job.end_date} for {job.write}')
+            continue
+        jobs += [job]
+    if not jobs:
+        return
+    # Every output's frames as (shared image index, frames showing it)
+    runs = []
+    for job in jobs:
+        offset = int(np.searchsorted(p.image_times, job.image_times[0]))
+        runs += [deque((offset + image, count) for image, _, count
+                       in FramePlan.from_params(job).runs())]
+    total = sum(count for job_runs in runs for _, count in job_runs)
+    needed = np.unique(np.fromiter(
+        (image for job_runs in runs for image, _ in job_runs), dtype=np.intp))
+
+    decode = copy(p)
+    decode.resolution = max(job.resolution for job in jobs)
+    shapes = [None] * len(jobs)
+    compositors = [None] * len(jobs)
+    writers = [PipeWriter(job.write, job.input_dict, job.output_dict)
+               for job in jobs]
+    written = 0
+    try:
+        with ThreadPoolExecutor(max_workers=p.decode_threads) as pool:
+            def load(image: int) -> np.ndarray:
+                return cache.load(decode, p.image_times[image])
+
+            # Decoding runs at most queue_depth images ahead of the writers
+            todo = iter(needed)
+            pending = deque((image, pool.submit(load, image)) for image
+                            in itertools.islice(todo, p.queue_depth))
+            while pending:
+                image, future = pending.popleft()
+                for ahead in itertools.islice(todo, 1):
+                    pending.append((ahead, pool.submit(load, ahead)))
+                frame = future.result()
+                for n, job in enumerate(jobs):
+                    if not runs[n] or runs[n][0][0] != image:
+                        continue
+                    _, count = runs[n].popleft()
+                    if shapes[n] is None:
+                        # Later images are fitted to the first, as in
+                        # process_frame
+                        shapes[n] = scaled_shape(
+                            frame.shape, 100 * job.resolution /
+                            decode.resolution)
+                    plot = plot_ghi(job, p.image_times[image])
+                    with stats.stage('composite'):
+                        scaled = resize_frame(frame, shapes[n], p.resampling)
+                        if compositors[n] is None or \
+                                not compositors[n].fits(scaled, plot):
+                            compositors[n] = Compositor(scaled.shape,
+                                                        plot.shape)
+                        out = compositors[n].compose(scaled, plot,
+                                                     mask=plot_mask(job))
+                    writers[n].writeFrame(out, count)
+                    written += count
+                    if progress is not None:
+                        progress(written / total)
+    finally:
+        errors = []
+        for writer in writers:
+            try:
+                writer.close()
+            except RuntimeError as e:
+                errors += [e]
+    if errors:
+        raise errors[0]
@@ -0,0 +1,166 @@
+"""Renders the frames of a single timelapse with several processes"""
+import logging
+import multiprocessing as mp
+import queue
+import traceback
+from datetime import datetime
+from multiprocessing import shared_memory
+from typing import Callable, Sequence
+
+import numpy as np
+
+from pv_timelapse.frame_cache import FrameCache
+from pv_timelapse.frame_tools import process_frame
+from pv_timelapse.indexing import Params
+from pv_timelapse.instrumentation import stats
+from pv_timelapse.plotting import plot_ghi, plot_mask
+
+
+def _render(p: Params, img_date: datetime, cache: FrameCache,
+            out: np.ndarray = None) -> np.ndarray:
+    """Loads, plots and composites one frame"""
+    frame_image = cache.load(p, img_date)
+    plot = plot_ghi(p, img_date)
+    return process_frame(frame_image, 100, plot, p.resampling, out,
+                         plot_mask(p))
+
+
+def _worker(p: Params, img_dates: Sequence[datetime], shm_name: str,
+            shape: tuple, slots: int, tasks: mp.Queue, done: mp.Queue,
+            cache_mb: float):
+    """
+    Renders frame ranges from the task queue into the shared ring
+
+    :param p: parameter container
+    :param img_dates: date of the source image for every output frame
+    :param shm_name: name of the shared memory block holding the ring
+    :param shape: shape of one output frame
+    :param slots: number of frames in the ring
+    :param tasks: queue of (start, stop) frame ranges, None to exit
+    :param done: queue receiving (start, stop), the statistics of the worker
+        when it exits or an error message
+    :param cache_mb: memory budget of this worker's frame cache
+    """
+    # A forked worker starts with a copy of the parent's statistics
+    stats.reset()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    cache = FrameCache(cache_mb)
+    ring = None
+    try:
+        ring = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=shm.buf)
+        while True:
+            task = tasks.get()
+            if task is None:
+                done.put(stats.to_dict())
+                break
+            start, stop = task
+            for n in range(start, stop):
+                if n > start and img_dates[n] == img_dates[n - 1]:
+                    # Same image as the previous frame, copy it over
+                    ring[n % slots] = ring[(n - 1) % slots]
+                else:
+                    _render(p, img_dates[n], cache, ring[n % slots])
+            done.put((start, stop))
+    except BaseException:
+        done.put(traceback.format_exc())
+    finally:
+        # The view has to go before the shared memory can be closed
+        ring = None
+        shm.close()
+
+
+def render_parallel(p: Params, img_dates: Sequence[datetime], frame_writer,
+                    workers: int, chunk: int = 4, slots: int = None,
+                    progress: Callable[[float], None] = None):
+    """
+    Writes the frames for the given image dates, rendering disjoint frame
+    ranges in worker processes.
+
+    Workers composite straight into a ring of preallocated uint8 frames in
+    shared memory, so no frame is pickled. The calling process is the only
+    writer and feeds the frames to ffmpeg in order. A range is only handed
+    out once every ring slot it maps to has been written.
+
+    Every worker keeps its own frame cache and gets an equal share of
+    p.cache_mb. An image shown in frames of different workers is decoded by
+    each of them.
+
+    :param p: parameter container
+    :param img_dates: date of the source image for every output frame
+    :param frame_writer: object with a writeFrame method that copies the
+        frame before returning
+    :param workers: number of rendering processes
+    :param chunk: number of consecutive frames per task
+    :param slots: number of frames in the ring, a multiple of chunk.
+        Defaults to two chunks per worker.
+    :param progress: called with the fraction of frames written
+    """
+    total = len(img_dates)
+    if total == 0:
+        return
+    if slots is None:
+        slots = 2 * workers * chunk
+    slots = max(slots // chunk, 1) * chunk
+
+    # The first frame fixes the output shape for the ring
+    first = _render(p, img_dates[0], FrameCache(0))
+    frame_writer.writeFrame(first)
+    shape = first.shape
+    img_dates = list(img_dates)
+
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=slots * int(np.prod(shape)))
+    ring = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=shm.buf)
+    tasks = mp.Queue()
+    done = mp.Queue()
+    procs = [mp.Process(target=_worker,
+                        args=(p, img_dates, shm.name, shape, slots, tasks,
+                              done, p.cache_mb / workers), daemon=True)
+             for _ in range(workers)]
+    try:
+        for proc in procs:
+            proc.start()
+        issued = 1
+        written = 1
+        ready = {}
+        while written < total:
+            # Hand out every range whose slots are already free
+            while issued < total and issued + chunk <= written + slots:
+                stop = min(issued + chunk, total)
+                tasks.put((issued, stop))
+                issued = stop
+            try:
+                result = done.get(timeout=1)
+            except queue.Empty:
+                if not all(proc.is_alive() for proc in procs):
+                    raise RuntimeError('A frame worker exited unexpectedly')
+                continue
+            if isinstance(result, str):
+                raise RuntimeError(f'Frame worker failed:\n{result}')
+            start, stop = result
+            ready[start] = stop
+            stats.sample('ranges waiting', len(ready))
+            while written in ready:
+                stop = ready.pop(written)
+                for n in range(written, stop):
+                    frame_writer.writeFrame(ring[n % slots])
+                written = stop
+                if progress is not None:
+                    progress(written / total)
+        for _ in procs:
+            tasks.put(None)
+        for _ in procs:
+            result = done.get()
+            if isinstance(result, str):
+                raise RuntimeError(f'Frame worker failed:\n{result}')
+            stats.merge(result)
+        for proc in procs:
+            proc.join()
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        del ring
+        shm.close()
+        shm.unlink()
+        logging.debug(f'Frame workers stopped for {p.write}')
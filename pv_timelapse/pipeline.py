@@ -0,0 +1,148 @@
+"""Streaming decode / composite / encode pipeline for a single timelapse"""
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Sequence
+
+from pv_timelapse.frame_cache import FrameCache
+from pv_timelapse.frame_tools import process_frame
+from pv_timelapse.indexing import Params
+from pv_timelapse.instrumentation import stats
+from pv_timelapse.plotting import plot_ghi, plot_mask
+
+_DONE = object()
+
+
+class _Failure:
+    """Carries an exception from a stage thread to the writer"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Puts an item on a bounded queue, giving up once the pipeline stops
+
+    :return: whether the item was queued
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """
+    Takes an item from a queue, returning _DONE once the pipeline stops
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(p: Params, img_dates: Sequence[datetime], frame_writer,
+                 decode_threads: int = 2, queue_depth: int = 8,
+                 progress: Callable[[float], None] = None,
+                 cache: FrameCache = None):
+    """
+    Writes the frames for the given image dates with decoding, compositing
+    and encoding running concurrently.
+
+    Decoding is spread over a thread pool, the plot and the compositing run in
+    one thread and the calling thread feeds the writer. The stages are linked
+    by queues of at most queue_depth frames, so memory stays bounded. Frames
+    are written in the order of img_dates.
+
+    :param p: parameter container
+    :param img_dates: date of the source image for every output frame
+    :param frame_writer: object with a writeFrame(frame, repeat, owned,
+        release) method like PipeWriter's, taking over the frames and
+        releasing them once written
+    :param decode_threads: number of threads decoding images
+    :param queue_depth: maximum number of frames waiting between two stages
+    :param progress: called with the fraction of frames written
+    :param cache: cache to load the images through
+    """
+    if cache is None:
+        cache = FrameCache(p.cache_mb)
+    stop = threading.Event()
+    decoded = queue.Queue(maxsize=queue_depth)
+    composited = queue.Queue(maxsize=queue_depth)
+    # Output frames cycle between the compositing thread and the writer
+    free = queue.Queue()
+    for _ in range(queue_depth + 2):
+        free.put(None)
+
+    def decode(pool: ThreadPoolExecutor):
+        try:
+            # Consecutive frames showing the same image are rendered once
+            for img_date, run in itertools.groupby(img_dates):
+                count = sum(1 for _ in run)
+                future = pool.submit(cache.load, p, img_date)
+                if not _put(decoded, (img_date, future, count), stop):
+                    return
+            _put(decoded, _DONE, stop)
+        except BaseException as e:
+            _put(decoded, _Failure(e), stop)
+
+    def composite():
+        try:
+            while True:
+                item = _get(decoded, stop)
+                if item is _DONE or isinstance(item, _Failure):
+                    _put(composited, item, stop)
+                    return
+                img_date, future, count = item
+                frame_image = future.result()
+                plot = plot_ghi(p, img_date)
+                out = _get(free, stop)
+                if out is _DONE:
+                    return
+                frame = process_frame(frame_image, 100, plot, p.resampling,
+                                      out, plot_mask(p))
+                if out is None:
+                    # First use of this slot, detach it from the module buffer
+                    frame = frame.copy()
+                if not _put(composited, (frame, count), stop):
+                    return
+        except BaseException as e:
+            _put(composited, _Failure(e), stop)
+
+    with ThreadPoolExecutor(max_workers=decode_threads) as pool:
+        threads = [threading.Thread(target=decode, args=(pool,), daemon=True),
+                   threading.Thread(target=composite, daemon=True)]
+        for t in threads:
+            t.start()
+        try:
+            written = 0
+            while True:
+                item = composited.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                frame, count = item
+                stats.sample('decoded queue', decoded.qsize())
+                stats.sample('composited queue', composited.qsize())
+                # The writer encodes the frame without copying it and hands
+                # it back to the compositing thread once written
+                frame_writer.writeFrame(frame, count, owned=True,
+                                        release=free.put)
+                written += count
+                if progress is not None:
+                    progress(written / len(img_dates))
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            logging.debug(f'Pipeline stopped for {p.write}')
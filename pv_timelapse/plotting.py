@@ -1,49 +1,160 @@
+import weakref
 from datetime import datetime, timedelta
-from typing import Union
+from typing import List, Tuple, Union
 
 import numpy as np
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.ticker import LinearLocator, FuncFormatter
 
+from pv_timelapse.frame_tools import OverlayMask
 from pv_timelapse.indexing import Params
+from pv_timelapse.instrumentation import stats
+from pv_timelapse.irradiance import IrradianceSeries
+from pv_timelapse.lod import envelope_path
+from pv_timelapse.raster_plot import RasterPlotRenderer
 
 a = False
-def plot_ghi(p: Params, img_date: datetime,
-             data_freq: Union[int, float] = 1) -> np.ndarray:
+
+# One renderer per parameter container, dropped with the container
+_renderers = weakref.WeakKeyDictionary()
+
+
+class PlotRenderer:
+    """
+    Draws the static parts of the GHI plot once and only redraws the cursor
+    and the irradiance label for each frame
+    """
+
+    def __init__(self, p: Params):
+        """
+        Renders the axes and the irradiance curve and stores the background
+
+        :param p: parameter container
+        """
+        # Imported here so workers using the raster renderer never load it
+        from matplotlib.backends.backend_agg import \
+            FigureCanvasAgg as FigureCanvas
+        from matplotlib.figure import Figure
+        from matplotlib.ticker import LinearLocator, FuncFormatter
+
+        self.start_date = p.start_date
+        self.end_date = p.end_date
+        self.ghi_times = p.ghi_times
+        self.ghi_data = p.ghi_data
+        self.series = IrradianceSeries(p.ghi_times, p.ghi_data)
+
+        def offset_formatter(x, pos=None):
+            label_date = self.start_date + timedelta(seconds=x)
+            return label_date.strftime('%H:%M')
+
+        locator = LinearLocator(numticks=8)
+        self.fig = Figure()
+        self.canvas = FigureCanvas(self.fig)
+        self.ax = self.fig.gca()
+        # The minimum and maximum of every pixel column draw the same curve
+        # as all samples, including short cloud transients
+        seconds, ghi = envelope_path(*self.series.envelope(
+            self.start_date, self.end_date, max(int(self.ax.bbox.width), 1)))
+        self.ax.plot(seconds, ghi, linewidth=1.0)
+        # Animated artists are skipped by canvas.draw and drawn per frame
+        self.cursor = self.ax.axvline(0, ymax=0.05, color='r', animated=True)
+        self.label = self.ax.text(0.2, 0.95, '', transform=self.ax.transAxes,
+                                  ha='right', va='center', animated=True)
+        self.ax.spines['top'].set_visible(False)
+        self.ax.spines['right'].set_visible(False)
+        # The spines sit above the lines, keep the cursor under the x axis
+        self.ax.spines['bottom'].set_animated(True)
+        self.ax.xaxis.set_major_locator(locator)
+        self.ax.xaxis.set_major_formatter(FuncFormatter(offset_formatter))
+        self.ax.set_ylim([-50, 1400])
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.mask = OverlayMask(
+            np.invert(np.asarray(self.canvas.buffer_rgba())[::, ::, :3]),
+            self._boxes())
+
+    def _boxes(self) -> List[Tuple[slice, slice]]:
+        """
+        Where the cursor, the bottom spine and the label can draw, in rows
+        from the top of the image
+        """
+        height = int(self.fig.bbox.height)
+        axes = self.ax.bbox
+        # The label is right aligned, longer values only reach further left
+        self.label.set_text('-9999.9 W/m²')
+        label = self.label.get_window_extent(self.canvas.get_renderer())
+        self.label.set_text('')
+        return [(slice(int(height - axes.y0 - 0.05 * axes.height) - 3,
+                       int(height - axes.y0) + 4),
+                 slice(int(axes.x0) - 3, int(axes.x1) + 4)),
+                (slice(int(height - label.y1) - 3, int(height - label.y0) + 4),
+                 slice(0, int(label.x1) + 4))]
+
+    def matches(self, p: Params) -> bool:
+        """
+        Whether the stored background is still valid for a container
+
+        :param p: parameter container
+        """
+        return (self.start_date == p.start_date and
+                self.end_date == p.end_date and
+                self.ghi_times is p.ghi_times and
+                self.ghi_data is p.ghi_data)
+
+    def render(self, img_date: datetime) -> np.ndarray:
+        """
+        Creates an image of the GHI plot with the cursor at the given date
+
+        :param img_date: date of the image being written
+        :return: the plot as an image
+        """
+        data_date = (img_date - self.start_date).total_seconds()
+
+        self.canvas.restore_region(self.background)
+        self.cursor.set_xdata([data_date, data_date])
+        self.label.set_text(
+            '{:>7.1f} W/m²'.format(self.series.value_at(img_date)))
+        self.ax.draw_artist(self.cursor)
+        self.ax.draw_artist(self.ax.spines['bottom'])
+        self.ax.draw_artist(self.label)
+
+        image = np.asarray(self.canvas.buffer_rgba())[::, ::, :3]
+        return np.invert(image)
+
+
+def get_renderer(p: Params) -> Union[PlotRenderer, RasterPlotRenderer]:
+    """
+    Returns the cached plot renderer for a parameter container, creating it
+    if the dates or irradiance data changed
+
+    :param p: parameter container
+    :return: the plot renderer selected by p.plot_renderer
+    """
+    renderer_class = RasterPlotRenderer if p.plot_renderer == 'numpy' \
+        else PlotRenderer
+    renderer = _renderers.get(p)
+    if not isinstance(renderer, renderer_class) or not renderer.matches(p):
+        renderer = renderer_class(p)
+        _renderers[p] = renderer
+    return renderer
+
+
+def plot_mask(p: Params) -> OverlayMask:
+    """
+    Where the images of plot_ghi can be non-black, so compositing only scans
+    the parts that change between frames
+
+    :param p: paramater container
+    :return: the mask of the plot renderer
+    """
+    return get_renderer(p).mask
+
+
+def plot_ghi(p: Params, img_date: datetime) -> np.ndarray:
     """
     Creates an image of the GHI plot
 
     :param p: paramater container
     :param img_date: date of the image being written
-    :param data_freq: frequency in seconds of the input data
     :return: the plot as an image
     """
-    data_date = (img_date-p.start_date).total_seconds() / data_freq
-
-    def offset_formatter(x, pos=None):
-        x_delta = timedelta(seconds=(x/data_freq))
-        label_date = p.start_date + x_delta
-        return label_date.strftime('%H:%M')
-
-    locator = LinearLocator(numticks=8)
-    fig = Figure()
-    canvas = FigureCanvas(fig)
-    ax = fig.gca()
-    ax.plot(p.ghi_data, linewidth=1.0)
-    ax.axvline(data_date, ymax=0.05, color='r')
-    ax.text(0.2, 0.95,
-            '{:>7.1f} W/m²'.format(p.ghi_data[int(data_date)]),
-            transform=ax.transAxes, ha='right', va='center')
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.xaxis.set_major_locator(locator)
-    ax.xaxis.set_major_formatter(FuncFormatter(offset_formatter))
-    ax.set_ylim([-50,1400])
-    canvas.draw()
-
-    image = np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep='')
-    image = image.reshape(fig.canvas.get_width_height()[::-1] + (3,))
-
-    return np.invert(image)
-
+    with stats.stage('plot'):
+        return get_renderer(p).render(img_date)
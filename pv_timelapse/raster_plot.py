@@ -0,0 +1,294 @@
+"""GHI plot drawn directly into NumPy arrays, without matplotlib"""
+from datetime import datetime, timedelta
+from typing import Tuple
+
+import numpy as np
+
+from pv_timelapse.frame_tools import OverlayMask
+from pv_timelapse.indexing import Params
+from pv_timelapse.irradiance import IrradianceSeries
+from pv_timelapse.lod import envelope_path
+
+# 5x7 bitmap glyphs, '#' marks a set pixel. Glyphs may be narrower.
+_GLYPHS = {
+    '0': ['.###.', '#...#', '#...#', '#...#', '#...#', '#...#', '.###.'],
+    '1': ['..#..', '.##..', '..#..', '..#..', '..#..', '..#..', '.###.'],
+    '2': ['.###.', '#...#', '....#', '...#.', '..#..', '.#...', '#####'],
+    '3': ['.###.', '#...#', '....#', '..##.', '....#', '#...#', '.###.'],
+    '4': ['...#.', '..##.', '.#.#.', '#..#.', '#####', '...#.', '...#.'],
+    '5': ['#####', '#....', '####.', '....#', '....#', '#...#', '.###.'],
+    '6': ['..##.', '.#...', '#....', '####.', '#...#', '#...#', '.###.'],
+    '7': ['#####', '....#', '...#.', '..#..', '.#...', '.#...', '.#...'],
+    '8': ['.###.', '#...#', '#...#', '.###.', '#...#', '#...#', '.###.'],
+    '9': ['.###.', '#...#', '#...#', '.####', '....#', '...#.', '.##..'],
+    ':': ['.', '.', '#', '.', '.', '#', '.'],
+    '.': ['.', '.', '.', '.', '.', '.', '#'],
+    '-': ['....', '....', '....', '####', '....', '....', '....'],
+    '−': ['....', '....', '....', '####', '....', '....', '....'],
+    ' ': ['...', '...', '...', '...', '...', '...', '...'],
+    '/': ['....#', '...#.', '...#.', '..#..', '.#...', '.#...', '#....'],
+    'W': ['#...#', '#...#', '#...#', '#.#.#', '#.#.#', '##.##', '#...#'],
+    'm': ['.....', '.....', '##.#.', '#.#.#', '#.#.#', '#.#.#', '#.#.#'],
+    'n': ['.....', '.....', '#.##.', '##..#', '#...#', '#...#', '#...#'],
+    'a': ['.....', '.....', '.###.', '....#', '.####', '#...#', '.####'],
+    '²': ['##.', '..#', '.#.', '###', '...', '...', '...'],
+}
+
+# Layout of matplotlib's default 640x480 figure with a single axes
+_SIZE = (480, 640)
+_AXES = (80.0, 57.6, 576.0, 427.2)  # left, top, right, bottom
+_Y_LIMITS = (-50.0, 1400.0)
+_MARGIN = 0.05
+_X_TICKS = 8
+_TICK_LENGTH = 5
+_LINE_COLOR = (31, 119, 180)
+_LINE_WIDTH = 1.39
+_CURSOR_COLOR = (255, 0, 0)
+_CURSOR_WIDTH = 2
+
+
+def _area_matrix(in_size: int, out_size: int) -> np.ndarray:
+    """Weights averaging in_size samples into out_size by overlap"""
+    edges_in = np.arange(in_size + 1) * (out_size / in_size)
+    edges_out = np.arange(out_size + 1)
+    overlap = (np.minimum(edges_out[1:, np.newaxis], edges_in[1:]) -
+               np.maximum(edges_out[:-1, np.newaxis], edges_in[:-1]))
+    return overlap.clip(0, None)
+
+
+def _coverage(lo: np.ndarray, hi: np.ndarray, size: int) -> np.ndarray:
+    """
+    Fraction of every pixel covered by spans along one axis
+
+    :param lo: start of every span in pixels
+    :param hi: end of every span in pixels
+    :param size: number of pixels
+    :return: coverage of shape (size, number of spans)
+    """
+    pixels = np.arange(size, dtype=np.float64)[::, np.newaxis]
+    return (np.minimum(pixels + 1, hi) - np.maximum(pixels, lo)).clip(0, 1)
+
+
+def _blend(image: np.ndarray, alpha: np.ndarray, color: tuple):
+    """Paints a color over an image with per pixel opacity, in place"""
+    alpha = alpha[::, ::, np.newaxis]
+    image[...] = (image * (1 - alpha) +
+                  np.asarray(color, np.float64) * alpha + 0.5).astype(np.uint8)
+
+
+def nice_ticks(lo: float, hi: float, max_ticks: int = 9) -> np.ndarray:
+    """
+    Round tick values within a range, with steps of 1, 2, 2.5 or 5 times a
+    power of ten like matplotlib's default locator
+
+    :param lo: start of the range
+    :param hi: end of the range
+    :param max_ticks: most ticks to place
+    :return: the tick values
+    """
+    magnitude = 10 ** np.floor(np.log10((hi - lo) / max_ticks))
+    for step in [1, 2, 2.5, 5, 10]:
+        step *= magnitude
+        ticks = np.arange(np.ceil(lo / step), np.floor(hi / step) + 1) * step
+        if len(ticks) <= max_ticks:
+            return ticks
+    return np.array([lo, hi])
+
+
+class BitmapFont:
+    """
+    Small bitmap font, area-scaled once to the wanted size so the glyphs get
+    antialiased edges
+    """
+
+    def __init__(self, height: int = 10, spacing: int = 2):
+        """
+        :param height: glyph height in pixels
+        :param spacing: pixels between glyphs
+        """
+        self.height = height
+        self.spacing = spacing
+        rows = _area_matrix(7, height)
+        self.glyphs = {}
+        for char, bitmap in _GLYPHS.items():
+            bits = np.array([[c == '#' for c in row] for row in bitmap],
+                            dtype=np.float64)
+            width = max(int(round(bits.shape[1] * height / 7)), 1)
+            alpha = rows @ bits @ _area_matrix(bits.shape[1], width).T
+            # Strokes thinner than two pixels would come out grey
+            self.glyphs[char] = (alpha / (height / 7) ** 2 * 1.5).clip(0, 1)
+
+    def measure(self, text: str) -> int:
+        """Width of a text in pixels"""
+        widths = [self.glyphs[c].shape[1] for c in text if c in self.glyphs]
+        return sum(widths) + self.spacing * max(len(widths) - 1, 0)
+
+    def draw(self, image: np.ndarray, text: str, x: float, y: float,
+             ha: str = 'left', va: str = 'top', color: tuple = (0, 0, 0)):
+        """
+        Draws a text into an image, clipped to its bounds
+
+        :param image: uint8 RGB image
+        :param text: the text, unknown characters are skipped
+        :param x: horizontal anchor in pixels
+        :param y: vertical anchor in pixels
+        :param ha: 'left', 'center' or 'right' alignment to x
+        :param va: 'top', 'center' or 'bottom' alignment to y
+        :param color: text color
+        """
+        left = int(round(x - {'left': 0, 'center': 0.5, 'right': 1}[ha] *
+                         self.measure(text)))
+        top = int(round(y - {'top': 0, 'center': 0.5, 'bottom': 1}[va] *
+                        self.height))
+        for char in text:
+            alpha = self.glyphs.get(char)
+            if alpha is None:
+                continue
+            h, w = alpha.shape
+            y0, x0 = max(top, 0), max(left, 0)
+            y1 = min(top + h, image.shape[0])
+            x1 = min(left + w, image.shape[1])
+            if y0 < y1 and x0 < x1:
+                _blend(image[y0:y1, x0:x1],
+                       alpha[y0 - top:y1 - top, x0 - left:x1 - left], color)
+            left += w + self.spacing
+
+
+class RasterPlotRenderer:
+    """
+    Draws the same GHI plot as PlotRenderer with NumPy only. The background
+    with the axes, ticks and curve is rasterized once; every frame copies it
+    and adds the cursor and the irradiance label.
+    """
+
+    def __init__(self, p: Params, font: BitmapFont = None):
+        """
+        Rasterizes the axes and the irradiance curve
+
+        :param p: parameter container
+        :param font: font for the labels
+        """
+        self.start_date = p.start_date
+        self.end_date = p.end_date
+        self.ghi_times = p.ghi_times
+        self.ghi_data = p.ghi_data
+        self.series = IrradianceSeries(p.ghi_times, p.ghi_data)
+        self.font = font or BitmapFont()
+
+        left, top, right, bottom = _AXES
+        seconds, ghi = envelope_path(*self.series.envelope(
+            self.start_date, self.end_date, int(right - left)))
+        # Same x limits as matplotlib's autoscaling with default margins
+        span = (self.end_date - self.start_date).total_seconds()
+        first, last = (seconds[0], seconds[-1]) if len(seconds) else (0, span)
+        margin = (last - first) * _MARGIN or 1.0
+        self.x_limits = (first - margin, last + margin)
+
+        self.background = np.full(_SIZE + (3,), 255, dtype=np.uint8)
+        self._draw_curve(self.background, *self.to_pixels(seconds, ghi))
+        self._draw_axes(self.background)
+        # The label is right aligned, longer values only reach further left
+        label_x = left + 0.2 * (right - left)
+        label_y = int(round(top + 0.05 * (bottom - top) -
+                            self.font.height / 2))
+        self.mask = OverlayMask(np.invert(self.background), [
+            (slice(int(bottom - 0.05 * (bottom - top)), int(bottom) + 1),
+             slice(int(left), int(right) + 1)),
+            (slice(label_y - 1, label_y + self.font.height + 1),
+             slice(0, int(round(label_x)) + 1))])
+
+    def to_pixels(self, x: np.ndarray,
+                  y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Converts data coordinates to pixel coordinates"""
+        left, top, right, bottom = _AXES
+        x_lo, x_hi = self.x_limits
+        y_lo, y_hi = _Y_LIMITS
+        return (left + (np.asarray(x) - x_lo) / (x_hi - x_lo) * (right - left),
+                bottom - (np.asarray(y) - y_lo) / (y_hi - y_lo) *
+                (bottom - top))
+
+    def _draw_curve(self, image: np.ndarray, px: np.ndarray, py: np.ndarray):
+        """Draws the antialiased polyline one pixel column at a time"""
+        left, top, right, bottom = _AXES
+        columns = np.arange(int(left), int(right))
+        valid = np.isfinite(py)
+        if not valid.any():
+            return
+        # Extent of the line within every column: its ends at the column
+        # edges and any vertices in between
+        edges = np.interp(np.concatenate([columns, [columns[-1] + 1]]),
+                          px[valid], py[valid], left=np.nan, right=np.nan)
+        lows = np.fmin(edges[:-1], edges[1:])
+        highs = np.fmax(edges[:-1], edges[1:])
+        inside = (px >= columns[0]) & (px < columns[-1] + 1) & valid
+        index = px[inside].astype(np.intp) - columns[0]
+        np.fmin.at(lows, index, py[inside])
+        np.fmax.at(highs, index, py[inside])
+        # Gaps in the data stay gaps
+        gap = np.interp(columns + 0.5, px, (~valid).astype(np.float64)) > 0
+        lows[gap] = np.nan
+        highs[gap] = np.nan
+        drawn = np.isfinite(lows)
+        half = _LINE_WIDTH / 2
+        alpha = _coverage(lows[drawn] - half, highs[drawn] + half,
+                          image.shape[0])
+        region = image[::, columns[drawn]]
+        _blend(region, alpha, _LINE_COLOR)
+        image[::, columns[drawn]] = region
+
+    def _draw_axes(self, image: np.ndarray):
+        """Draws the left spine, the ticks and their labels"""
+        left, top, right, bottom = _AXES
+        row = int(bottom)
+        col = int(left)
+        image[int(top):row + 1, col] = 0
+
+        x_ticks = np.linspace(*self.x_limits, _X_TICKS)
+        for tick, px in zip(x_ticks, self.to_pixels(x_ticks, 0)[0]):
+            px = int(round(px))
+            image[row:row + _TICK_LENGTH + 1, px] = 0
+            label = self.start_date + timedelta(seconds=float(tick))
+            self.font.draw(image, label.strftime('%H:%M'), px,
+                           row + _TICK_LENGTH + 6, ha='center')
+
+        # Adding zero turns -0.0 into 0.0
+        y_ticks = nice_ticks(*_Y_LIMITS) + 0.0
+        for tick, py in zip(y_ticks, self.to_pixels(0, y_ticks)[1]):
+            py = int(round(py))
+            image[py, col - _TICK_LENGTH:col] = 0
+            self.font.draw(image, f'{tick:g}'.replace('-', '−'),
+                           col - _TICK_LENGTH - 5, py, ha='right',
+                           va='center')
+
+    def matches(self, p: Params) -> bool:
+        """
+        Whether the stored background is still valid for a container
+
+        :param p: parameter container
+        """
+        return (self.start_date == p.start_date and
+                self.end_date == p.end_date and
+                self.ghi_times is p.ghi_times and
+                self.ghi_data is p.ghi_data)
+
+    def render(self, img_date: datetime) -> np.ndarray:
+        """
+        Creates an image of the GHI plot with the cursor at the given date
+
+        :param img_date: date of the image being written
+        :return: the plot as an image
+        """
+        left, top, right, bottom = _AXES
+        image = self.background.copy()
+        x = self.to_pixels((img_date - self.start_date).total_seconds(), 0)[0]
+        x0 = int(round(x - _CURSOR_WIDTH / 2))
+        if left <= x0 and x0 + _CURSOR_WIDTH <= right:
+            image[int(bottom - 0.05 * (bottom - top)):int(bottom),
+                  x0:x0 + _CURSOR_WIDTH] = _CURSOR_COLOR
+        # The bottom spine covers the foot of the cursor
+        image[int(bottom), int(left):int(right) + 1] = 0
+        self.font.draw(image,
+                       '{:>7.1f} W/m²'.format(self.series.value_at(img_date)),
+                       left + 0.2 * (right - left),
+                       top + 0.05 * (bottom - top), ha='right', va='center')
+        return np.invert(image, out=image)
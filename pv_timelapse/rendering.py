@@ -0,0 +1,47 @@
+"""Renders the frames of a plan with the method selected in the parameters"""
+from typing import Callable
+
+from pv_timelapse.frame_cache import FrameCache
+from pv_timelapse.frame_plan import FramePlan
+from pv_timelapse.frame_tools import process_frame
+from pv_timelapse.indexing import Params
+from pv_timelapse.parallel import render_parallel
+from pv_timelapse.pipeline import run_pipeline
+from pv_timelapse.plotting import plot_ghi, plot_mask
+
+
+def render_frames(p: Params, plan: FramePlan, frame_writer,
+                  progress: Callable[[float], None] = None,
+                  cache: FrameCache = None):
+    """
+    Writes every frame of a plan, across processes, through the pipeline or
+    serially depending on the parameters
+
+    :param p: parameter container
+    :param plan: the frames to render
+    :param frame_writer: object with a writeFrame(frame, repeat) method
+    :param progress: called with the fraction of frames written
+    :param cache: cache of decoded images shared between calls. Not used
+        with frame workers, which keep caches of their own.
+    """
+    if p.frame_workers > 1:
+        render_parallel(p, plan.img_dates, frame_writer, p.frame_workers,
+                        progress=progress)
+        return
+    if cache is None:
+        cache = FrameCache(p.cache_mb)
+    if p.pipeline:
+        run_pipeline(p, plan.img_dates, frame_writer, p.decode_threads,
+                     p.queue_depth, progress=progress, cache=cache)
+    else:
+        # Consecutive frames showing the same image are rendered once
+        for image, start, count in plan.runs():
+            img_date = plan.image_times[image]
+            frame_image = cache.load(p, img_date)
+            plot = plot_ghi(p, img_date)
+            # The image comes in already scaled to the output resolution
+            to_writer = process_frame(frame_image, 100, plot, p.resampling,
+                                      mask=plot_mask(p))
+            frame_writer.writeFrame(to_writer, count)
+            if progress is not None:
+                progress((start + count) / len(plan))
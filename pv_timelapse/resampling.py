@@ -0,0 +1,228 @@
+"""uint8 resampling backends used to scale the sky images"""
+import warnings
+from typing import Tuple
+
+import numpy as np
+from skimage import img_as_ubyte
+from skimage.transform import resize
+
+METHODS = ['auto', 'box', 'filter', 'skimage']
+
+# Fixed point precision of the filter weights
+_PRECISION = 14
+
+
+def scaled_shape(shape: tuple, resolution: int) -> tuple:
+    """
+    Shape of a frame scaled to a percentage of its size
+
+    :param shape: shape of the source frame
+    :param resolution: percentage to scale the frame by
+    :return: shape of the scaled frame
+    """
+    scale = resolution / 100
+    return (max(int(round(shape[0] * scale)), 1),
+            max(int(round(shape[1] * scale)), 1)) + tuple(shape[2:])
+
+
+def box_factor(resolution: int) -> int:
+    """
+    Integer downscaling factor for a resolution, 0 if there is none
+
+    :param resolution: percentage to scale the frame by
+    :return: the factor, e.g. 2 for 50%
+    """
+    if 0 < resolution <= 100 and 100 % resolution == 0:
+        return 100 // resolution
+    return 0
+
+
+def box_downscale(frame: np.ndarray, factor: int,
+                  shape: tuple = None) -> np.ndarray:
+    """
+    Downscales a uint8 frame by averaging factor x factor pixel blocks.
+    Trailing rows and columns that do not fill a block are dropped, unless
+    the shape asks for one more row or column, which then averages them.
+
+    :param frame: uint8 frame to scale
+    :param factor: integer downscaling factor
+    :param shape: shape of the scaled frame, at most one row and column
+        larger than the number of whole blocks, e.g. from scaled_shape
+    :return: the scaled uint8 frame
+    """
+    if factor == 1:
+        return frame
+    rows = frame.shape[0] // factor
+    cols = frame.shape[1] // factor
+    if shape is not None and tuple(shape[:2]) != (rows, cols):
+        return _box_partial(frame, factor, shape)
+    blocks = frame[:rows * factor, :cols * factor].reshape(
+        (rows, factor, cols, factor) + frame.shape[2:])
+    count = factor * factor
+    acc_type = np.uint16 if count * 255 < 2 ** 16 else np.uint32
+    # Adding strided views is much faster than a reduction over small axes
+    acc = blocks[::, 0, ::, 0].astype(acc_type)
+    for row in range(factor):
+        for col in range(factor):
+            if row or col:
+                acc += blocks[::, row, ::, col]
+    acc += count // 2
+    acc //= count
+    return acc.astype(np.uint8)
+
+
+def _box_partial(frame: np.ndarray, factor: int,
+                 shape: tuple) -> np.ndarray:
+    """Box downscaling with the trailing partial blocks as an extra edge"""
+    rows = frame.shape[0] // factor
+    cols = frame.shape[1] // factor
+    if not (rows <= shape[0] <= rows + 1 and cols <= shape[1] <= cols + 1):
+        raise ValueError(f'Cannot box downscale {frame.shape[:2]} by '
+                         f'{factor} to {tuple(shape[:2])}')
+    out = np.empty(tuple(shape[:2]) + frame.shape[2:], dtype=np.uint8)
+    out[:rows, :cols] = box_downscale(frame, factor)
+    top = rows * factor
+    left = cols * factor
+    channels = frame.shape[2:]
+    if shape[0] > rows and cols:
+        out[rows, :cols] = np.rint(frame[top:, :left].reshape(
+            (-1, cols, factor) + channels).mean(axis=(0, 2)))
+    if shape[1] > cols and rows:
+        out[:rows, cols] = np.rint(frame[:top, left:].reshape(
+            (rows, factor, -1) + channels).mean(axis=(1, 2)))
+    if shape[0] > rows and shape[1] > cols:
+        out[rows, cols] = np.rint(frame[top:, left:].mean(axis=(0, 1)))
+    return out
+
+
+class Resampler:
+    """Separable triangle filter resampler working in fixed point integers"""
+
+    def __init__(self):
+        self._coefficients = {}
+
+    def coefficients(self, in_size: int,
+                     out_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Source indices and integer weights for resizing one axis. Cached per
+        pair of sizes.
+
+        :param in_size: length of the source axis
+        :param out_size: length of the resized axis
+        :return: index and weight arrays of shape (out_size, taps)
+        """
+        key = (in_size, out_size)
+        if key not in self._coefficients:
+            scale = in_size / out_size
+            # Widen the filter when downscaling so every source pixel counts
+            support = max(scale, 1.0)
+            centers = (np.arange(out_size) + 0.5) * scale
+            taps = int(np.ceil(support)) * 2 + 1
+            left = np.floor(centers - support).astype(np.intp)
+            index = left[::, np.newaxis] + np.arange(taps)
+            weights = 1 - np.abs(
+                (index + 0.5 - centers[::, np.newaxis]) / support)
+            weights[(index < 0) | (index >= in_size)] = 0
+            weights = np.clip(weights, 0, None)
+            weights /= weights.sum(axis=1, keepdims=True)
+            int_weights = np.round(weights * (1 << _PRECISION)).astype(
+                np.int32)
+            # Make every row sum to exactly one so flat areas stay flat
+            int_weights[np.arange(out_size), weights.argmax(axis=1)] += \
+                (1 << _PRECISION) - int_weights.sum(axis=1)
+            self._coefficients[key] = (np.clip(index, 0, in_size - 1),
+                                       int_weights)
+        return self._coefficients[key]
+
+    def resize_axis(self, frame: np.ndarray, out_size: int,
+                    axis: int) -> np.ndarray:
+        """
+        Resizes a uint8 frame along one axis
+
+        :param frame: uint8 frame to scale
+        :param out_size: new length of the axis
+        :param axis: 0 for rows, 1 for columns
+        :return: the scaled uint8 frame
+        """
+        if frame.shape[axis] == out_size:
+            return frame
+        index, weights = self.coefficients(frame.shape[axis], out_size)
+        shape = list(frame.shape)
+        shape[axis] = out_size
+        broadcast = [1] * frame.ndim
+        broadcast[axis] = out_size
+        acc = np.full(shape, 1 << (_PRECISION - 1), dtype=np.int32)
+        term = np.empty(shape, dtype=np.int32)
+        for tap in range(index.shape[1]):
+            np.multiply(np.take(frame, index[::, tap], axis=axis),
+                        weights[::, tap].reshape(broadcast), out=term)
+            acc += term
+        acc >>= _PRECISION
+        return acc.astype(np.uint8)
+
+    def resize(self, frame: np.ndarray, shape: tuple) -> np.ndarray:
+        """
+        Resizes a uint8 frame to the given shape
+
+        :param frame: uint8 frame to scale
+        :param shape: target shape, only the first two entries are used
+        :return: the scaled uint8 frame
+        """
+        # Shrink the larger reduction first to keep the intermediate small
+        if shape[0] / frame.shape[0] <= shape[1] / frame.shape[1]:
+            frame = self.resize_axis(frame, shape[0], 0)
+            return self.resize_axis(frame, shape[1], 1)
+        frame = self.resize_axis(frame, shape[1], 1)
+        return self.resize_axis(frame, shape[0], 0)
+
+
+_resampler = Resampler()
+
+
+def resize_frame(frame: np.ndarray, shape: tuple,
+                 method: str = 'auto') -> np.ndarray:
+    """
+    Resizes a frame to a given shape
+
+    :param frame: the frame to scale
+    :param shape: target shape, only the first two entries are used
+    :param method: 'filter' or 'auto' for the integer resampler, 'skimage'
+        for skimage's spline interpolation
+    :return: the scaled uint8 frame
+    """
+    if frame.shape[:2] == tuple(shape[:2]):
+        return frame
+    if method == 'skimage' or frame.dtype != np.uint8:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return img_as_ubyte(resize(frame, tuple(shape[:2]) +
+                                       frame.shape[2:], mode='constant'))
+    return _resampler.resize(frame, shape)
+
+
+def scale_frame(frame: np.ndarray, resolution: int,
+                method: str = 'auto') -> np.ndarray:
+    """
+    Scales a frame to a percentage of its size without leaving uint8
+
+    :param frame: the frame to scale
+    :param resolution: percentage to scale the frame by
+    :param method: 'box' averages pixel blocks and needs a resolution that
+        divides 100, 'filter' uses the integer triangle filter, 'auto' picks
+        'box' when possible and 'filter' otherwise, 'skimage' uses skimage's
+        floating point spline interpolation
+    :return: the scaled uint8 frame
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown resampling method: {method}')
+    if resolution == 100:
+        return frame
+    factor = box_factor(resolution)
+    if method == 'box' and not factor:
+        raise ValueError(f'Box resampling needs a resolution that divides '
+                         f'100, got {resolution}')
+    shape = scaled_shape(frame.shape, resolution)
+    if method in ['box', 'auto'] and factor and frame.dtype == np.uint8:
+        # Same shape as the other methods, which round rather than floor
+        return box_downscale(frame, factor, shape)
+    return resize_frame(frame, shape, method)
@@ -0,0 +1,148 @@
+"""Spreads the timelapses of several days over a pool of worker processes"""
+import logging
+import time
+import traceback
+from functools import partial
+from multiprocessing import Pool
+from typing import Callable, Iterator, List
+
+import numpy as np
+
+from pv_timelapse.indexing import Params
+
+# Relative cost of encoding a frame, decoding and compositing an image and
+# segmenting an image at reduced resolution
+_ENCODE_COST = 1.0
+_DECODE_COST = 2.0
+_SEGMENT_COST = 0.2
+
+
+class JobResult:
+    """Outcome of one timelapse rendered by a worker"""
+
+    def __init__(self, write: str, cost: float, seconds: float,
+                 error: str = None, report: dict = None):
+        """
+        :param write: path of the output video
+        :param cost: estimated cost the job was scheduled with
+        :param seconds: wall time the job took in its worker
+        :param error: traceback if the job failed, None otherwise
+        :param report: what the job returned, the timing report for
+            create_timelapse
+        """
+        self.write = write
+        self.cost = cost
+        self.seconds = seconds
+        self.error = error
+        self.report = report
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def count_images(p: Params) -> float:
+    """
+    Number of images between the dates of a parameter container, without
+    listing the folders unless the image index can answer from its cache.
+    Otherwise it is estimated from the length of the interval and the image
+    interval of the camera.
+
+    :param p: parameter container with dates set
+    :return: the number of images
+    """
+    if len(p.image_times):
+        return len(p.image_times)
+    if p.index is None:
+        return (p.end_date - p.start_date).total_seconds() / \
+            p.image_interval
+    start = np.datetime64(p.start_date)
+    end = np.datetime64(p.end_date)
+    images = 0
+    for folder in p.find_folders():
+        dates = p.index.image_times(folder)
+        images += int(np.searchsorted(dates, end, 'right') -
+                      np.searchsorted(dates, start, 'left'))
+    return images
+
+
+def estimate_cost(p: Params) -> float:
+    """
+    Relative cost of rendering a timelapse. Every frame of every output is
+    encoded, each image shown is decoded once and every image is segmented.
+
+    :param p: parameter container with dates set
+    :return: the estimated cost, only comparable between jobs of one run
+    """
+    images = count_images(p)
+    total_frames = p.duration * int(p.input_dict['-r'])
+    cost = total_frames * _ENCODE_COST + \
+        min(images, total_frames) * _DECODE_COST
+    for output in p.outputs:
+        cost += (output.duration or p.duration) * _ENCODE_COST * \
+            int((output.input_dict or p.input_dict)['-r'])
+    if p.seg_write:
+        cost += images * _SEGMENT_COST
+    return cost
+
+
+def warm_worker():
+    """
+    Pool initializer loading the heavy imports and the matplotlib font
+    cache once per process instead of once per job
+    """
+    import pvlib.solarposition  # noqa: F401
+    import skimage.transform  # noqa: F401
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    figure.add_subplot(111).set_title('warm up')
+    figure.canvas.draw()
+
+
+def _run_job(func: Callable[[Params], None], job) -> JobResult:
+    """Runs one job in a worker, timing it and catching its errors"""
+    cost, p = job
+    start = time.perf_counter()
+    report = None
+    error = None
+    try:
+        report = func(p)
+    except Exception:
+        error = traceback.format_exc()
+    return JobResult(p.write, cost, time.perf_counter() - start, error,
+                     report)
+
+
+def run_jobs(jobs: List[Params], processes: int,
+             func: Callable[[Params], None] = None) -> Iterator[JobResult]:
+    """
+    Runs jobs in a pool of warm worker processes, most expensive first so no
+    long day is left to run alone at the end. Results are yielded in the
+    order the jobs finish.
+
+    :param jobs: parameter containers of the timelapses
+    :param processes: number of worker processes
+    :param func: called with each container, create_timelapse by default
+    :return: iterator of the results
+    """
+    if func is None:
+        from pv_timelapse.create_timelapse import create_timelapse
+        func = create_timelapse
+    logger = logging.getLogger('Scheduler')
+    costed = sorted(((estimate_cost(p), p) for p in jobs),
+                    key=lambda job: job[0], reverse=True)
+    for cost, p in costed:
+        logger.info(f'{p.write}: estimated cost {cost:.0f}')
+    with Pool(processes=processes, initializer=warm_worker) as pool:
+        # One job per dispatch, so idle workers always take the next longest
+        for result in pool.imap_unordered(partial(_run_job, func), costed,
+                                          chunksize=1):
+            if result.ok:
+                logger.info(f'{result.write} done in {result.seconds:.1f} s')
+            else:
+                logger.error(f'{result.write} failed after '
+                             f'{result.seconds:.1f} s:\n{result.error}')
+            yield result
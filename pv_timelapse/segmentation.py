@@ -1,22 +1,127 @@
-"""Boilerplate for later addition of a segmentation algorithm"""
+"""Cloud segmentation of the sky images by their red/blue ratio"""
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
 import numpy as np
-from typing import TextIO
-from datetime import datetime
-import csv
+import pandas as pd
+
+from pv_timelapse.indexing import Params
+from pv_timelapse.instrumentation import stats
+from pv_timelapse.loading import load_frame
+
+# Fixed point scale for comparing red against a fraction of blue
+_SCALE = 1024
+
+
+@functools.lru_cache(maxsize=8)
+def sky_mask(shape: tuple, radius: float = 0.95) -> np.ndarray:
+    """
+    Circular mask of the sky in a fisheye image, computed once per
+    resolution
 
+    :param shape: shape of the images, only the first two entries are used
+    :param radius: radius as a fraction of the inscribed circle, below one
+        to leave out the horizon
+    :return: read-only boolean mask
+    """
+    height, width = shape[:2]
+    y = np.arange(height)[::, np.newaxis] - (height - 1) / 2
+    x = np.arange(width)[np.newaxis, ::] - (width - 1) / 2
+    mask = y ** 2 + x ** 2 <= (radius * min(height, width) / 2) ** 2
+    mask.flags.writeable = False
+    return mask
+
+
+def cloud_fraction(images: np.ndarray, mask: np.ndarray,
+                   threshold: float = 0.6) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Share of cloudy sky pixels in a batch of images. Clear sky scatters far
+    more blue than red, clouds about as much of both, so a pixel counts as
+    cloud where red > threshold * blue.
 
-def compute_segmentation(image: np.ndarray, image_date: datetime,
-                         csv_writer: csv.writer):
+    :param images: uint8 RGB images of shape (n, height, width, 3)
+    :param mask: boolean sky mask of shape (height, width)
+    :param threshold: red/blue ratio above which a pixel is cloud
+    :return: cloud fraction and overall red/blue ratio of every image
     """
-    Writes segmentation data
+    sky = images[::, mask]
+    red = sky[::, ::, 0].astype(np.int32)
+    blue = sky[::, ::, 2].astype(np.int32)
+    cloudy = red * _SCALE > int(round(threshold * _SCALE)) * blue
+    fractions = np.count_nonzero(cloudy, axis=1) / max(sky.shape[1], 1)
+    ratios = red.sum(axis=1) / np.maximum(blue.sum(axis=1), 1)
+    return fractions, ratios
+
 
-    :param image: image to process
-    :param image_date: date of the input image
-    :param csv_file: file to write data to
+def segment_images(p: Params, image_times: pd.DatetimeIndex,
+                   resolution: int = 25, threshold: float = 0.6,
+                   batch: int = 32, threads: int = 2) -> pd.DataFrame:
     """
-    csv_writer.writerow([str(image_date), algorithm(image)])
+    Segments every image, whether the video shows it or not. Images are
+    decoded at a reduced resolution and processed in batches.
 
+    :param p: parameter container for the image paths and loader
+    :param image_times: dates of the images
+    :param resolution: percentage of the source resolution to work at
+    :param threshold: red/blue ratio above which a pixel is cloud
+    :param batch: images processed at once
+    :param threads: threads decoding images
+    :return: table with the time, cloud fraction and red/blue ratio of
+        every image
+    """
+    fractions = np.zeros(len(image_times))
+    ratios = np.zeros(len(image_times))
 
-def algorithm(image: np.ndarray) -> float:
-    """Implement segmentation algorithm here"""
-    return 0
\ No newline at end of file
+    def load(img_date):
+        return load_frame(p.date_to_path(img_date), resolution, p.loader,
+                          p.resampling)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for start in range(0, len(image_times), batch):
+            images = list(pool.map(load, image_times[start:start + batch]))
+            stop = start + len(images)
+            if all(image.shape == images[0].shape for image in images):
+                fractions[start:stop], ratios[start:stop] = cloud_fraction(
+                    np.stack(images), sky_mask(images[0].shape), threshold)
+                continue
+            for n, image in enumerate(images, start):
+                (fractions[n],), (ratios[n],) = cloud_fraction(
+                    image[np.newaxis], sky_mask(image.shape), threshold)
+    return pd.DataFrame({'time': pd.DatetimeIndex(image_times),
+                         'cloud_fraction': fractions,
+                         'red_blue_ratio': ratios})
+
+
+def write_segmentation(table: pd.DataFrame, path: os.path.abspath):
+    """
+    Writes a segmentation table in one go, as columns of an .npz file, a
+    .parquet file or a .csv file depending on the extension
+
+    :param table: table from segment_images
+    :param path: output file
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npz':
+        np.savez(path, **{column: table[column].to_numpy()
+                          for column in table.columns})
+    elif ext == '.parquet':
+        table.to_parquet(path, index=False)
+    elif ext == '.csv':
+        table.to_csv(path, index=False)
+    else:
+        raise ValueError(f'Unknown segmentation output format: {ext}')
+
+
+def compute_segmentation(p: Params):
+    """
+    Segments all images of a parameter container and writes the result to
+    p.seg_write
+
+    :param p: parameter container with indexed images
+    """
+    with stats.stage('segmentation'):
+        table = segment_images(p, p.image_times, p.seg_resolution,
+                               p.cloud_threshold, threads=p.decode_threads)
+        write_segmentation(table, p.seg_write)
@@ -0,0 +1,160 @@
+"""Resumable rendering in fixed-length segments joined without re-encoding"""
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from pv_timelapse.frame_cache import FrameCache
+from pv_timelapse.frame_plan import FramePlan
+from pv_timelapse.indexing import Params
+from pv_timelapse.rendering import render_frames
+from pv_timelapse.video_writer import PipeWriter
+
+
+class SegmentManifest:
+    """
+    Records the segments of a video that were completely written, each with
+    a key describing what it shows
+    """
+    logger = logging.getLogger('Segments')
+
+    def __init__(self, directory: os.path.abspath):
+        """
+        :param directory: directory holding the segments and the manifest
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok=True)
+        self.segments = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as f:
+                    self.segments = json.load(f)['segments']
+            except (OSError, ValueError, KeyError):
+                self.logger.warning(f'Discarding broken manifest {self.path}')
+
+    def is_done(self, name: str, key: str) -> bool:
+        """Whether a segment exists and still shows what the key describes"""
+        return (self.segments.get(name) == key and
+                os.path.isfile(os.path.join(self.directory, name)))
+
+    def record(self, name: str, key: str = None):
+        """
+        Marks a segment as complete, or forgets it if key is None
+        """
+        if key is None:
+            self.segments.pop(name, None)
+        else:
+            self.segments[name] = key
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'segments': self.segments}, f, indent=1,
+                      sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def video_key(p: Params) -> bytes:
+    """
+    Digest of everything that shapes the frames of a video apart from which
+    images they show: the plot data, the scaling and the encoder options
+    """
+    key = hashlib.sha1()
+    key.update(repr((str(p.start_date), str(p.end_date), p.source,
+                     p.resolution, p.resampling, p.plot_renderer,
+                     sorted(p.input_dict.items()),
+                     sorted(p.output_dict.items()))).encode())
+    key.update(np.ascontiguousarray(p.ghi_times).tobytes())
+    key.update(np.ascontiguousarray(p.ghi_data).tobytes())
+    return key.digest()
+
+
+def concat_segments(paths: List[os.path.abspath], output: os.path.abspath,
+                    ffmpeg: str = 'ffmpeg'):
+    """
+    Joins video files with ffmpeg's concat demuxer, copying the streams
+
+    :param paths: the segments in order
+    :param output: the joined video
+    :param ffmpeg: ffmpeg executable
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.txt',
+                                     delete=False) as listing:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            listing.write(f"file '{escaped}'\n")
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+             '-i', listing.name, '-c', 'copy', output],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(listing.name)
+    if result.returncode != 0:
+        raise RuntimeError(f'ffmpeg failed joining {output}: '
+                           f'{result.stderr.decode(errors="replace").strip()}')
+
+
+def render_segments(p: Params, plan: FramePlan, segment_frames: int,
+                    progress: Callable[[float], None] = None,
+                    cache: FrameCache = None):
+    """
+    Renders a video as segments of a fixed number of frames next to the
+    output, in a directory named after it with '.parts' appended. Segments
+    whose frames are unchanged since an earlier run are kept, so an
+    interrupted video only renders what is missing. The segments are then
+    joined without re-encoding.
+
+    :param p: parameter container with dates and indexed images
+    :param plan: the frames of the video
+    :param segment_frames: frames per segment
+    :param progress: called with the fraction of frames done
+    :param cache: cache of decoded images shared between segments
+    """
+    directory = p.write + '.parts'
+    manifest = SegmentManifest(directory)
+    base = video_key(p)
+    ext = os.path.splitext(p.write)[1]
+    names = []
+    for number, start in enumerate(range(0, len(plan), segment_frames)):
+        stop = min(start + segment_frames, len(plan))
+        part = plan[start:stop]
+        name = f'{number:05d}{ext}'
+        names += [name]
+        key = hashlib.sha1(base + pd.DatetimeIndex(
+            part.img_dates).asi8.tobytes()).hexdigest()
+        if manifest.is_done(name, key):
+            if progress is not None:
+                progress(stop / len(plan))
+            continue
+
+        manifest.record(name, None)
+        tmp_path = os.path.join(directory, f'{number:05d}.tmp{ext}')
+        writer = PipeWriter(tmp_path, p.input_dict, p.output_dict)
+
+        def part_progress(done: float, start=start, stop=stop):
+            progress((start + done * (stop - start)) / len(plan))
+
+        try:
+            render_frames(p, part, writer,
+                          part_progress if progress else None, cache)
+        finally:
+            writer.close()
+        os.replace(tmp_path, os.path.join(directory, name))
+        manifest.record(name, key)
+
+    # Segments past the end of a shorter plan are stale
+    for name in list(manifest.segments):
+        if name not in names:
+            manifest.record(name, None)
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    concat_segments([os.path.join(directory, name) for name in names],
+                    p.write)
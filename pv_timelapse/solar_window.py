@@ -0,0 +1,191 @@
+"""Sunrise and sunset at a minimum solar elevation for whole date ranges"""
+import hashlib
+import logging
+import os
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from pvlib.solarposition import get_solarposition
+
+_NOON = np.int64(12 * 3600 * 10 ** 9)
+_DAY_END = np.int64((23 * 3600 + 59 * 60) * 10 ** 9)
+
+
+class SolarWindow:
+    """
+    Finds when the sun crosses a minimum elevation, rising in the morning and
+    setting in the afternoon, for many days at once. The elevation is
+    evaluated on a coarse grid over every day in one call, then the grid
+    cells holding a crossing are bisected together until the crossing is
+    known to within a second. Finished days can be kept on disk per site and
+    elevation.
+    """
+    logger = logging.getLogger('Solar')
+
+    def __init__(self, latitude: float, longitude: float, altitude: float,
+                 tz: str, min_elevation: float, step: float = 600,
+                 tolerance: float = 1, cache_dir: os.path.abspath = None):
+        """
+        :param latitude: of the site in decimal degrees
+        :param longitude: of the site in decimal degrees
+        :param altitude: of the site above sea level in meters
+        :param tz: time zone name of the site, days start at its midnight
+        :param min_elevation: apparent solar elevation in degrees the
+            window starts and ends at
+        :param step: seconds between the coarse grid points
+        :param tolerance: seconds the crossings are refined to
+        :param cache_dir: directory to keep the windows in, None to compute
+            them on every run
+        """
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.tz = str(tz)
+        self.min_elevation = min_elevation
+        self.step = np.int64(step * 10 ** 9)
+        self.tolerance = np.int64(tolerance * 10 ** 9)
+        self.cache_file = None
+        if cache_dir:
+            key = hashlib.sha1(repr((latitude, longitude, altitude, self.tz,
+                                     min_elevation, step, tolerance))
+                               .encode()).hexdigest()[:16]
+            os.makedirs(cache_dir, exist_ok=True)
+            self.cache_file = os.path.join(cache_dir, f'solar_{key}.npz')
+
+    def elevation(self, times: np.ndarray) -> np.ndarray:
+        """
+        Apparent solar elevation, with the refraction of standard pressure
+        like pvlib's calc_time
+
+        :param times: UTC times as int64 nanoseconds, any shape
+        :return: elevation in degrees, same shape as times
+        """
+        index = pd.DatetimeIndex(times.ravel(), tz='UTC')
+        position = get_solarposition(index, self.latitude, self.longitude,
+                                     self.altitude, pressure=101325.0)
+        return position['apparent_elevation'].to_numpy().reshape(times.shape)
+
+    def _refine(self, low: np.ndarray, high: np.ndarray,
+                rising: bool) -> np.ndarray:
+        """
+        Bisects all brackets at once until they are narrower than the
+        tolerance
+
+        :param low: UTC times in ns before the crossings
+        :param high: UTC times in ns after the crossings
+        :param rising: whether the sun rises through the threshold
+        :return: the crossings
+        """
+        while len(low) and np.max(high - low) > self.tolerance:
+            middle = low + (high - low) // 2
+            above = self.elevation(middle) >= self.min_elevation
+            after = above if rising else ~above
+            high = np.where(after, middle, high)
+            low = np.where(after, low, middle)
+        return high if rising else low
+
+    def compute(self, days: pd.DatetimeIndex) -> Tuple[np.ndarray,
+                                                      np.ndarray]:
+        """
+        Windows of days without the disk cache. The morning crossing is
+        searched between midnight and noon, the evening one between noon and
+        23:59. A sun already above the threshold at midnight, or still above
+        at 23:59, starts or ends the window there; a sun that never reaches
+        it gives NaT.
+
+        :param days: midnights of the days, localized to the site time zone
+        :return: start and end of every window in naive local time, as
+            datetime64[ns]
+        """
+        # Nanoseconds whatever unit pandas picked for the index
+        starts = days.tz_convert('UTC').tz_localize(None).to_numpy() \
+            .astype('datetime64[ns]').view(np.int64)
+        offsets = np.arange(0, _DAY_END + 1, self.step, dtype=np.int64)
+        if offsets[-1] != _DAY_END:
+            offsets = np.append(offsets, _DAY_END)
+        grid = starts[::, np.newaxis] + offsets[np.newaxis, ::]
+        above = self.elevation(grid) >= self.min_elevation
+        noon = int(np.searchsorted(offsets, _NOON, 'right'))
+        rows = np.arange(len(days))
+
+        # First grid cell in the morning where the sun gets above
+        rise = ~above[::, :noon - 1] & above[::, 1:noon]
+        has_rise = rise.any(axis=1)
+        cell = np.argmax(rise, axis=1)
+        sunrise = np.full(len(days), np.iinfo(np.int64).min, dtype=np.int64)
+        sunrise[has_rise] = self._refine(
+            grid[rows, cell][has_rise], grid[rows, cell + 1][has_rise], True)
+        sunrise[above[::, 0]] = starts[above[::, 0]]
+
+        # Last grid cell in the afternoon where the sun gets below
+        afternoon = above[::, noon - 1:]
+        sets = afternoon[::, :-1] & ~afternoon[::, 1:]
+        has_set = sets.any(axis=1)
+        cell = noon - 1 + sets.shape[1] - 1 - np.argmax(sets[::, ::-1],
+                                                        axis=1)
+        sunset = np.full(len(days), np.iinfo(np.int64).min, dtype=np.int64)
+        sunset[has_set] = self._refine(
+            grid[rows, cell][has_set], grid[rows, cell + 1][has_set], False)
+        sunset[above[::, -1]] = grid[::, -1][above[::, -1]]
+
+        missing = (sunrise == np.iinfo(np.int64).min) | \
+            (sunset == np.iinfo(np.int64).min)
+        sunrise[missing] = np.iinfo(np.int64).min
+        sunset[missing] = np.iinfo(np.int64).min
+        return (pd.DatetimeIndex(sunrise, tz='UTC').tz_convert(self.tz)
+                .tz_localize(None).to_numpy(),
+                pd.DatetimeIndex(sunset, tz='UTC').tz_convert(self.tz)
+                .tz_localize(None).to_numpy())
+
+    def windows(self, first_day: pd.Timestamp,
+                count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Windows of consecutive days, computing only the days missing from
+        the disk cache
+
+        :param first_day: any time on the first day
+        :param count: number of days
+        :return: start and end of every window in naive local time, as
+            datetime64[ns], NaT for days the sun stays below the threshold
+        """
+        first = pd.Timestamp(first_day)
+        if first.tzinfo is not None:
+            first = first.tz_convert(self.tz).tz_localize(None)
+        dates = pd.date_range(first.normalize(), periods=count, freq='D')
+        keys = dates.to_numpy().astype('datetime64[D]')
+
+        cached_days = np.array([], dtype='datetime64[D]')
+        cached_starts = np.array([], dtype='datetime64[ns]')
+        cached_ends = np.array([], dtype='datetime64[ns]')
+        if self.cache_file and os.path.isfile(self.cache_file):
+            try:
+                with np.load(self.cache_file) as cached:
+                    cached_days = cached['days']
+                    cached_starts = cached['starts']
+                    cached_ends = cached['ends']
+            except (OSError, KeyError, ValueError):
+                self.logger.warning(
+                    f'Discarding broken solar cache {self.cache_file}')
+
+        missing = ~np.isin(keys, cached_days)
+        if missing.any():
+            starts, ends = self.compute(
+                dates[missing].tz_localize(self.tz, ambiguous=True,
+                                           nonexistent='shift_forward'))
+            cached_days = np.concatenate([cached_days, keys[missing]])
+            cached_starts = np.concatenate([cached_starts, starts])
+            cached_ends = np.concatenate([cached_ends, ends])
+            order = np.argsort(cached_days)
+            cached_days = cached_days[order]
+            cached_starts = cached_starts[order]
+            cached_ends = cached_ends[order]
+            if self.cache_file:
+                tmp_file = f'{self.cache_file}.{os.getpid()}.tmp'
+                with open(tmp_file, 'wb') as f:
+                    np.savez(f, days=cached_days, starts=cached_starts,
+                             ends=cached_ends)
+                os.replace(tmp_file, self.cache_file)
+
+        found = np.searchsorted(cached_days, keys)
+        return cached_starts[found], cached_ends[found]
@@ -0,0 +1,172 @@
+"""Writes raw frames straight into an ffmpeg process"""
+import logging
+import queue
+import subprocess
+import tempfile
+import threading
+from typing import Callable
+
+import numpy as np
+
+from pv_timelapse.instrumentation import stats
+
+_STOP = None
+
+
+class PipeWriter:
+    """
+    Encodes frames by streaming them into the stdin of one ffmpeg process.
+
+    Every frame is copied once into a buffer owned by the writer, so callers
+    may reuse their arrays right away, unless the caller hands the frame over
+    and gets it back once written. A background thread hands the buffers to
+    the pipe as memoryviews while the caller prepares the next frames.
+    """
+    logger = logging.getLogger('Writer')
+
+    def __init__(self, path: str, input_dict: dict = None,
+                 output_dict: dict = None, ffmpeg: str = 'ffmpeg',
+                 queue_depth: int = 4):
+        """
+        :param path: output video file
+        :param input_dict: ffmpeg options for the raw input, e.g. '-r'
+        :param output_dict: ffmpeg options for the encoded output
+        :param ffmpeg: ffmpeg executable
+        :param queue_depth: frames buffered ahead of the pipe
+        """
+        self.path = path
+        self.input_dict = dict(input_dict or {})
+        self.output_dict = dict(output_dict or {})
+        self.ffmpeg = ffmpeg
+        self.queue_depth = queue_depth
+        self.shape = None
+        self.frames = 0
+        self._process = None
+        self._thread = None
+        self._queue = None
+        self._free = None
+        self._stderr = None
+        self._error = None
+
+    def command(self, shape: tuple) -> list:
+        """
+        The ffmpeg command line for frames of a shape
+
+        :param shape: (height, width, 3) of the frames
+        :return: list of arguments
+        """
+        output_dict = dict(self.output_dict)
+        # Players expect 4:2:0 chroma, which needs even dimensions
+        output_dict.setdefault('-pix_fmt', 'yuv420p')
+        if (shape[0] % 2 or shape[1] % 2) and '-vf' not in output_dict:
+            output_dict['-vf'] = 'pad=ceil(iw/2)*2:ceil(ih/2)*2'
+        args = [self.ffmpeg, '-y', '-loglevel', 'error',
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                '-s', f'{shape[1]}x{shape[0]}']
+        for key, value in self.input_dict.items():
+            args += [key, str(value)]
+        args += ['-i', '-']
+        for key, value in output_dict.items():
+            args += [key, str(value)]
+        return args + [self.path]
+
+    def _start(self, shape: tuple):
+        self.shape = shape
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(self.command(shape), bufsize=0,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.DEVNULL,
+                                         stderr=self._stderr)
+        self._queue = queue.Queue()
+        self._free = queue.Queue()
+        # Buffers are only allocated for frames that are copied
+        for _ in range(self.queue_depth):
+            self._free.put(None)
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        """Writes queued buffers to the pipe until told to stop"""
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            buffer, repeat, slot, release = item
+            if self._error is None:
+                try:
+                    view = memoryview(buffer).cast('B')
+                    # Time blocked on the pipe is time ffmpeg needs to encode
+                    with stats.stage('encode'):
+                        for _ in range(repeat):
+                            self._process.stdin.write(view)
+                    stats.count('bytes written', view.nbytes * repeat)
+                except OSError as e:
+                    self._error = e
+            if release is not None:
+                release(buffer)
+            self._free.put(slot)
+
+    def _ffmpeg_error(self) -> RuntimeError:
+        self._stderr.seek(0)
+        message = self._stderr.read().decode(errors='replace').strip()
+        return RuntimeError(f'ffmpeg failed writing {self.path}: '
+                            f'{message or self._error}')
+
+    def writeFrame(self, frame: np.ndarray, repeat: int = 1,
+                   owned: bool = False,
+                   release: Callable[[np.ndarray], None] = None):
+        """
+        Queues a frame for encoding
+
+        :param frame: uint8 RGB frame, all frames must have the same shape
+        :param repeat: number of consecutive frames showing it
+        :param owned: hand the frame over instead of copying it. The caller
+            must not touch it until it is released.
+        :param release: called with an owned frame from the writer thread
+            once it is written, e.g. to reuse it
+        """
+        if self._process is None:
+            self._start(frame.shape)
+        elif frame.shape != self.shape:
+            raise ValueError(f'Frame shape {frame.shape} differs from the '
+                             f'first frame {self.shape}')
+        if self._error is not None:
+            raise self._ffmpeg_error()
+        stats.sample('writer queue', self._queue.qsize())
+        with stats.stage('writer wait'):
+            slot = self._free.get()
+        if owned and frame.dtype == np.uint8 and frame.flags.c_contiguous:
+            self._queue.put((frame, repeat, slot, release))
+        else:
+            if slot is None:
+                slot = np.empty(self.shape, dtype=np.uint8)
+            np.copyto(slot, frame, casting='unsafe')
+            self._queue.put((slot, repeat, slot, None))
+            if owned and release is not None:
+                release(frame)
+        self.frames += repeat
+        stats.count('frames', repeat)
+
+    def close(self):
+        """Writes the remaining frames and waits for ffmpeg to finish"""
+        if self._process is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        try:
+            self._process.stdin.close()
+        except OSError as e:
+            self._error = self._error or e
+        code = self._process.wait()
+        try:
+            if code != 0 or self._error is not None:
+                raise self._ffmpeg_error()
+        finally:
+            self._stderr.close()
+            self._process = None
+
+    def __enter__(self) -> 'PipeWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -17,8 +17,8 @@ setup(
     ],
     description='Generates time-lapse videos from sky camera images.',
     python_requires='>=3.5',
-    install_requires=['numpy', 'pandas', 'scikit-image', 'sk-video',
-                      'matplotlib', 'mysqlclient', 'pvlib', 'ephem', 'scipy'],
+    install_requires=['numpy', 'pandas', 'scikit-image',
+                      'matplotlib', 'mysqlclient', 'pvlib', 'scipy'],
     entry_points={
         'console_scripts': ['pv_timelapse=pv_timelapse:main']
     }
@@ -0,0 +1,120 @@
+"""End-to-end checks on the synthetic archive of the benchmark harness"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from pv_timelapse import segments
+from pv_timelapse.benchmark import (COLUMN, TABLE, TIME_COLUMN, bench_params,
+                                    make_archive, make_irradiance_db)
+from pv_timelapse.frame_plan import FramePlan
+from pv_timelapse.frame_tools import reset_frame_shape
+from pv_timelapse.irradiance import IrradianceSource
+from pv_timelapse.rendering import render_frames
+
+START = datetime(2020, 6, 1, 8)
+HOURS = 0.1
+DAYS = 2
+
+
+class FrameRecorder:
+    """Writer keeping the shape and a digest of every frame it is given"""
+
+    def __init__(self, path: str = None, *args):
+        self.path = path
+        self.frames = 0
+        self.shapes = set()
+        self.digest = hashlib.sha1()
+
+    def writeFrame(self, frame: np.ndarray, repeat: int = 1,
+                   owned: bool = False, release=None):
+        self.shapes.add(frame.shape)
+        for _ in range(repeat):
+            self.digest.update(np.ascontiguousarray(frame).tobytes())
+        self.frames += repeat
+        if owned and release is not None:
+            release(frame)
+
+    def close(self):
+        if self.path is not None:
+            with open(self.path, 'w') as f:
+                f.write(f'{self.frames} {self.digest.hexdigest()}')
+
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory):
+    root = tmp_path_factory.mktemp('archive')
+    images = str(root / 'images')
+    db = str(root / 'irradiance.db')
+    make_archive(images, START, DAYS, HOURS, cadence=60, shape=(1000, 1000))
+    make_irradiance_db(db, START, START + timedelta(days=DAYS - 1,
+                                                    hours=HOURS))
+    return images, db
+
+
+def params(archive, tmp_path, **kwargs):
+    images, db = archive
+    return bench_params(images, db, START, START + timedelta(hours=HOURS),
+                        duration=0.5, write=str(tmp_path / 'out.mp4'),
+                        **kwargs)
+
+
+@pytest.mark.parametrize('mode', ['pipeline', 'parallel', 'cached'])
+def test_modes_match_serial(archive, tmp_path, mode):
+    options = {'pipeline': {'pipeline': True},
+               'parallel': {'frame_workers': 2},
+               'cached': {'cache_mb': 64}}[mode]
+    results = []
+    for kwargs in [{}, options]:
+        reset_frame_shape()
+        p = params(archive, tmp_path, **kwargs)
+        plan = FramePlan.from_params(p)
+        writer = FrameRecorder()
+        render_frames(p, plan, writer)
+        results += [(writer.frames, writer.shapes, writer.digest.digest())]
+        assert writer.frames == len(plan)
+        assert len(writer.shapes) == 1
+    assert results[0] == results[1]
+
+
+def test_segments_resume(archive, tmp_path, monkeypatch):
+    rendered = []
+    joined = []
+
+    class Writer(FrameRecorder):
+        def __init__(self, path, *args):
+            super().__init__(path)
+            rendered.append(os.path.basename(path))
+
+    monkeypatch.setattr(segments, 'PipeWriter', Writer)
+    monkeypatch.setattr(segments, 'concat_segments',
+                        lambda paths, output: joined.append(paths))
+    p = params(archive, tmp_path)
+    plan = FramePlan.from_params(p)
+    segments.render_segments(p, plan, 4)
+    count = len(rendered)
+    assert count == -(-len(plan) // 4)
+
+    os.remove(os.path.join(p.write + '.parts', '00001.mp4'))
+    rendered.clear()
+    segments.render_segments(p, plan, 4)
+    assert rendered == ['00001.tmp.mp4']
+    assert joined[0] == joined[1]
+    assert len(joined[1]) == count
+
+
+def test_fetch_many_matches_fetch(archive):
+    _, db = archive
+    source = IrradianceSource.sqlite(db, TABLE, COLUMN, TIME_COLUMN)
+    ranges = [(START + timedelta(days=day),
+               START + timedelta(days=day, hours=HOURS))
+              for day in range(DAYS)]
+    many = source.fetch_many(ranges)
+    for (start, end), (times, values) in zip(ranges, many):
+        day_times, day_values = source.fetch(start, end)
+        assert len(times) > 0
+        np.testing.assert_array_equal(times, day_times)
+        np.testing.assert_array_equal(values, day_values)
+    source.close()